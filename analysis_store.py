@@ -0,0 +1,88 @@
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import metrics
+
+
+ANALYSIS_TTL_SECONDS = float(os.getenv("ANALYSIS_TTL_SECONDS", "1800"))
+ANALYSIS_MAX_ENTRIES = int(os.getenv("ANALYSIS_MAX_ENTRIES", "2000"))
+ANALYSIS_MAX_BYTES = int(os.getenv("ANALYSIS_MAX_BYTES", str(4 * 1024 * 1024)))
+
+
+class AnalysisStore:
+    """
+    Short-lived, size-bounded store of analysis results keyed by an opaque id.
+
+    Lets clients re-roll the playlist or history for a dish without re-uploading
+    the image. Only the text outputs of the vision step are kept, never the image.
+    Entries expire after ``ttl`` seconds and the least recently used entries are
+    evicted once either the entry or byte limit is exceeded.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._bytes = 0
+
+    def put(self, analysis: Dict) -> str:
+        analysis_id = secrets.token_urlsafe(12)
+        entry = {"data": dict(analysis), "expires": time.monotonic() + self.ttl}
+        entry["size"] = len(json.dumps(entry["data"]))
+        with self._lock:
+            self._entries[analysis_id] = entry
+            self._bytes += entry["size"]
+            self._evict()
+        return analysis_id
+
+    def get(self, analysis_id: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(analysis_id)
+            if entry is None or entry["expires"] < time.monotonic():
+                if entry is not None:
+                    self._drop(analysis_id)
+                metrics.incr("analysis_store_misses_total")
+                return None
+            self._entries.move_to_end(analysis_id)
+            metrics.incr("analysis_store_hits_total")
+            return dict(entry["data"])
+
+    def update(self, analysis_id: str, **changes) -> None:
+        """Merge ``changes`` into a live entry, e.g. the songs already served for it."""
+        with self._lock:
+            entry = self._entries.get(analysis_id)
+            if entry is None:
+                return
+            entry["data"].update(changes)
+            self._bytes -= entry["size"]
+            entry["size"] = len(json.dumps(entry["data"]))
+            self._bytes += entry["size"]
+            self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes}
+
+    def _drop(self, analysis_id: str) -> None:
+        entry = self._entries.pop(analysis_id)
+        self._bytes -= entry["size"]
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for analysis_id in [key for key, entry in self._entries.items() if entry["expires"] < now]:
+            self._drop(analysis_id)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+            metrics.incr("analysis_store_evictions_total")
+
+
+analysis_store = AnalysisStore(ANALYSIS_TTL_SECONDS, ANALYSIS_MAX_ENTRIES, ANALYSIS_MAX_BYTES)
+
+metrics.register_collector(lambda: {"analysis_store": analysis_store.stats()})
@@ -1,14 +1,24 @@
 import base64
+import hmac
 import os
 
 import requests
-from flask import Flask, jsonify, request, send_from_directory, send_file
+from flask import Flask, Response, g, jsonify, request, send_from_directory, send_file
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 
-from ingredients_playlist import analyze_food_image, get_playlist_from_ingredients, getproductdescription
+from analysis_store import analysis_store
+from ingredients_playlist import analyze_food_image
 from spotify_playlist import get_next_song, get_previous_song, parse_playlist
 from food_history import get_food_history
+from history_cache import CACHE_CONTROL as HISTORY_CACHE_CONTROL, clean_dish, history_cache
+from music_generation import MAX_STATUS_IDS, SUNO_CALLBACK_TOKEN, tracker as music_tracker
+from ollama_sessions import OLLAMA_PRELOAD, sessions
+from provider_router import generate_history, generate_playlist
+from response_encoding import compact_response, representation_tag
+from scheduler import SchedulerOverloaded, lane_from_request, scheduler
+import metrics
+import tracing
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -17,13 +27,58 @@ app.config["UPLOAD_FOLDER"] = "uploads"
 
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
+# Load and pin the history models now so the first user doesn't pay the cold start.
+if OLLAMA_PRELOAD:
+    sessions.preload_in_background()
+
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "bmp", "webp"}
+# Re-rolls avoid at most this many of the most recently served songs, so the
+# local index never runs dry and the LLM prompt stays bounded.
+MAX_AVOIDED_SONGS = int(os.getenv("MAX_AVOIDED_SONGS", "50"))
 
 
 def allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+@app.before_request
+def start_request_trace():
+    if request.path.startswith("/api/"):
+        g.trace_span, g.trace_token = tracing.start_span(
+            f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+            kind="server",
+            **{"http.method": request.method, "http.target": request.path, "http.request_bytes": request.content_length or 0},
+        )
+
+
+@app.after_request
+def tag_request_trace(response):
+    span = g.get("trace_span")
+    if span is not None:
+        span.set_attributes(**{"http.status_code": response.status_code, "http.response_bytes": response.content_length})
+    return response
+
+
+@app.teardown_request
+def end_request_trace(exc):
+    span = g.pop("trace_span", None)
+    if span is not None:
+        tracing.end_span(span, g.pop("trace_token", None), exc)
+
+
+def request_lane() -> str:
+    """Priority lane for this request, from the X-Request-Priority header or ?priority=."""
+    return lane_from_request(request.headers.get("X-Request-Priority") or request.args.get("priority"))
+
+
+@app.errorhandler(SchedulerOverloaded)
+def handle_overloaded(exc: SchedulerOverloaded):
+    response = jsonify({"error": str(exc), "lane": exc.lane, "retry_after": exc.retry_after})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(exc.retry_after)
+    return response
+
+
 def get_food_image_from_api():
     """Fallback: Get a random food image from an API service."""
     try:
@@ -54,7 +109,24 @@ def get_food_image_from_api():
 
 @app.route("/api/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok"}), 200
+    # Load balancers poll this; a deep queue tells them to back off this instance.
+    if scheduler.overloaded():
+        retry_after = scheduler.retry_after()
+        response = jsonify({"status": "overloaded", "queue_depth": scheduler.queue_depth(), "retry_after": retry_after})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(retry_after)
+        return response
+    return jsonify({"status": "ok", "queue_depth": scheduler.queue_depth()}), 200
+
+
+@app.route("/api/ollama/status", methods=["GET"])
+def ollama_status():
+    return jsonify(sessions.stats())
+
+
+@app.route("/api/metrics", methods=["GET"])
+def get_metrics():
+    return jsonify(metrics.snapshot())
 
 
 @app.route("/api/analyze-image", methods=["POST"])
@@ -70,6 +142,11 @@ def analyze_image():
     if not file or not allowed_file(file.filename):
         return jsonify({"error": "Invalid file type. Please upload an image file."}), 400
 
+    try:
+        lane = request_lane()
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
     filename = secure_filename(file.filename)
     filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
     file.save(filepath)
@@ -79,45 +156,66 @@ def analyze_image():
             image_bytes = handle.read()
         image_base64 = base64.b64encode(image_bytes).decode("utf-8")
 
-        analysis = analyze_food_image(image_base64)
+        with tracing.span("stage.vision"), scheduler.slot(lane):
+            analysis = analyze_food_image(image_base64)
         food_name = analysis.get("dish_name", "Unknown")
         ingredients = analysis.get("ingredients", "")
+        mood_tags = analysis.get("mood_tags", [])
+        # A degraded analysis means the vision circuit is open.
+        degraded = bool(analysis.get("degraded"))
 
-        if not ingredients:
-            ingredients = getproductdescription(
-                image_base64,
-                "Identify this dish's key ingredients. Only return the ingredient names, separated by commas.",
-            )
-
-        playlist = get_playlist_from_ingredients(ingredients)
+        with tracing.span("stage.playlist"), scheduler.slot(lane):
+            playlist, playlist_provider = generate_playlist(ingredients, moods=mood_tags)
 
         parsed_playlist = parse_playlist(playlist)
 
         # Get food history if we have a valid food name
         food_history_data = None
         if food_name and food_name.lower() != "unknown":
+            def generate():
+                with tracing.span("stage.history"), scheduler.slot(lane):
+                    return generate_history(food_name)
+
             try:
-                food_history_data = get_food_history(food_name, model="llama3.2:3b", verbose=False)
+                # Reuse the stored history so its ETag stays stable; only a miss generates and writes.
+                food_history_data = history_cache.get_or_create(food_name, None, generate)["history"]
             except Exception as food_history_error:
                 # Log error but don't fail the entire request
                 print(f"Warning: Could not fetch food history for '{food_name}': {food_history_error}")
                 food_history_data = None
 
+        analysis_id = analysis_store.put(
+            {
+                "food_name": food_name,
+                "ingredients": ingredients,
+                "mood_tags": mood_tags,
+                "served_songs": [song["song"] for song in parsed_playlist],
+            }
+        )
+
         response_data = {
             "success": True,
+            "analysis_id": analysis_id,
             "food_name": food_name,
             "ingredients": ingredients,
+            "cuisine": analysis.get("cuisine", ""),
+            "mood_tags": mood_tags,
             "playlist": playlist,
             "parsed_playlist": parsed_playlist,
+            "playlist_provider": playlist_provider,
             "source": "uploaded_image",
         }
+        if degraded:
+            response_data["degraded"] = True
         
         # Add food history if available
         if food_history_data:
             response_data["food_history"] = food_history_data
 
-        return jsonify(response_data)
+        return compact_response(response_data)
 
+    except SchedulerOverloaded:
+        raise
     except Exception as exc:
         return jsonify({"error": f"Error processing image: {exc}"}), 500
 
@@ -126,6 +224,105 @@ def analyze_image():
             os.remove(filepath)
 
 
+@app.route("/api/analysis/<analysis_id>/playlist", methods=["POST"])
+def reroll_playlist(analysis_id):
+    """
+    Generate another playlist for a previous analysis without re-uploading the image.
+
+    Songs already served for this analysis are excluded from the new playlist.
+    """
+    analysis = analysis_store.get(analysis_id)
+    if analysis is None:
+        return jsonify({"error": "Unknown or expired analysis_id. Please upload the image again."}), 404
+
+    try:
+        lane = request_lane()
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    try:
+        with tracing.span("stage.playlist", reroll=True), scheduler.slot(lane):
+            playlist, playlist_provider = generate_playlist(
+                analysis["ingredients"],
+                avoid=analysis["served_songs"][-MAX_AVOIDED_SONGS:],
+                moods=analysis.get("mood_tags"),
+            )
+
+        parsed_playlist = parse_playlist(playlist)
+        if not parsed_playlist:
+            print(f"Warning: re-roll for analysis {analysis_id} from '{playlist_provider}' produced no songs")
+            return jsonify({"error": "Could not generate a new playlist. Please try again."}), 502
+
+        served_songs = analysis["served_songs"] + [song["song"] for song in parsed_playlist]
+        analysis_store.update(analysis_id, served_songs=served_songs[-MAX_AVOIDED_SONGS:])
+
+        return compact_response(
+            {
+                "success": True,
+                "analysis_id": analysis_id,
+                "food_name": analysis["food_name"],
+                "ingredients": analysis["ingredients"],
+                "playlist": playlist,
+                "parsed_playlist": parsed_playlist,
+                "playlist_provider": playlist_provider,
+            }
+        )
+
+    except SchedulerOverloaded:
+        raise
+    except Exception as exc:
+        return jsonify({"error": f"Error generating playlist: {exc}"}), 500
+
+
+@app.route("/api/analysis/<analysis_id>/history", methods=["POST"])
+def reroll_history(analysis_id):
+    """
+    Regenerate food history for a previous analysis without re-uploading the image.
+
+    Request body (optional):
+        {
+            "model": "llama3.2:3b"  # omit to let the provider router pick
+        }
+    """
+    analysis = analysis_store.get(analysis_id)
+    if analysis is None:
+        return jsonify({"error": "Unknown or expired analysis_id. Please upload the image again."}), 404
+
+    food_name = analysis["food_name"]
+    if not food_name or food_name.lower() == "unknown":
+        return jsonify({"error": "The dish in this analysis could not be identified"}), 422
+
+    try:
+        lane = request_lane()
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    try:
+        model = (request.get_json(silent=True) or {}).get("model")
+        with tracing.span("stage.history", reroll=True), scheduler.slot(lane):
+            if model:
+                history_data = get_food_history(food_name, model=model, verbose=False)
+            else:
+                history_data, model = generate_history(food_name)
+
+        return compact_response(
+            {
+                "success": True,
+                "analysis_id": analysis_id,
+                "food_name": food_name,
+                "model": model,
+                "food_history": history_data,
+            }
+        )
+
+    except SchedulerOverloaded:
+        raise
+    except ConnectionError as exc:
+        return jsonify({"error": f"Connection error: {exc}"}), 503
+    except Exception as exc:
+        return jsonify({"error": f"Error getting food history: {exc}"}), 500
+
+
 @app.route("/api/playlist/navigation", methods=["POST"])
 def playlist_navigation():
     try:
@@ -206,21 +403,33 @@ def food_history():
     Request body:
         {
             "food_name": "Chicken Chowmein",
-            "model": "qwen3:8b"  # optional, defaults to qwen3:8b
+            "model": "llama3.2:3b"  # optional; omit to let the provider router pick
         }
     """
     try:
         data = request.get_json(force=True)
         food_name = data.get("food_name")
-        model = data.get("model", "qwen3:8b")  # Default to qwen3:8b
+        model = data.get("model")
         
         if not food_name:
             return jsonify({"error": "food_name is required"}), 400
-        
+
+        try:
+            lane = request_lane()
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+
         # Get food history information
-        history_data = get_food_history(food_name, model=model, verbose=False)
+        requested_model = model
+        with tracing.span("stage.history"), scheduler.slot(lane):
+            if model:
+                history_data = get_food_history(food_name, model=model, verbose=False)
+            else:
+                history_data, model = generate_history(food_name)
+        # Write through so GET /api/food-history/<dish> serves this answer from now on.
+        history_cache.put(food_name, requested_model, model, history_data)
         
-        return jsonify(
+        return compact_response(
             {
                 "success": True,
                 "food_name": food_name,
@@ -231,6 +440,47 @@ def food_history():
             }
         )
         
+    except SchedulerOverloaded:
+        raise
+    except ConnectionError as exc:
+        return jsonify({"error": f"Connection error: {exc}"}), 503
+    except ValueError as exc:
+        return jsonify({"error": f"Parsing error: {exc}"}), 500
+    except Exception as exc:
+        return jsonify({"error": f"Error getting food history: {exc}"}), 500
+
+
+@app.route("/api/food-history/<path:dish>", methods=["GET"])
+def food_history_cacheable(dish):
+    """
+    Cacheable form of /api/food-history, e.g. GET /api/food-history/Chicken%20Chowmein?model=llama3.2:3b
+
+    Histories are stored per dish and model, so repeat lookups never reach Ollama.
+    Responses carry a strong ETag derived from the stored content plus
+    Cache-Control with stale-while-revalidate for browser and edge caches, and
+    ``If-None-Match`` revalidations are answered with 304.
+    """
+    try:
+        dish = clean_dish(dish)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    model = request.args.get("model") or None
+
+    try:
+        lane = request_lane()
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    def generate():
+        with tracing.span("stage.history"), scheduler.slot(lane):
+            if model:
+                return get_food_history(dish, model=model, verbose=False), model
+            return generate_history(dish)
+
+    try:
+        entry = history_cache.get_or_create(dish, model, generate)
+    except SchedulerOverloaded:
+        raise
     except ConnectionError as exc:
         return jsonify({"error": f"Connection error: {exc}"}), 503
     except ValueError as exc:
@@ -238,6 +488,89 @@ def food_history():
     except Exception as exc:
         return jsonify({"error": f"Error getting food history: {exc}"}), 500
 
+    # Strong ETags name one exact byte sequence, so the negotiated encoding is part of the tag.
+    etag = f"{entry['digest'][:32]}-{representation_tag()}"
+    if request.if_none_match.contains_weak(etag):
+        metrics.incr("history_conditional_total", result="not_modified")
+        response = Response(status=304)
+        response.vary.update(["Accept", "Accept-Encoding"])
+    else:
+        metrics.incr("history_conditional_total", result="full")
+        history = entry["history"]
+        response = compact_response(
+            {
+                "success": True,
+                "food_name": entry["food_name"],
+                "model": entry["provider"],
+                "food_history": history["food_history"],
+                "modern_culture": history["modern_culture"],
+                "fun_facts": history["fun_facts"],
+            }
+        )
+    response.set_etag(etag)
+    response.last_modified = entry["generated_at"]
+    response.headers["Cache-Control"] = HISTORY_CACHE_CONTROL
+    return response
+
+
+@app.route("/api/music/generate", methods=["POST"])
+def generate_music():
+    """
+    Start a Suno music generation job. Poll /api/music/status/<task_id> for the result.
+
+    Request body:
+        {
+            "prompt": "A soft and soothing melody with piano and some cello",
+            "instrumental": false  # optional
+        }
+    """
+    try:
+        data = request.get_json(force=True)
+        prompt = (data.get("prompt") or "").strip()
+        if not prompt:
+            return jsonify({"error": "prompt is required"}), 400
+
+        task = music_tracker.submit(prompt, instrumental=bool(data.get("instrumental", False)))
+        return jsonify({"success": True, **task}), 202
+
+    except Exception as exc:
+        return jsonify({"error": f"Error starting music generation: {exc}"}), 502
+
+
+@app.route("/generate-music-callback", methods=["POST"])
+def music_callback():
+    """Receive Suno's generation callbacks (text, first, complete, error)."""
+    if SUNO_CALLBACK_TOKEN and not hmac.compare_digest(request.args.get("token", ""), SUNO_CALLBACK_TOKEN):
+        return jsonify({"error": "Invalid callback token"}), 403
+
+    payload = request.get_json(silent=True) or {}
+    task_id = music_tracker.record_callback(payload)
+    if not task_id:
+        return jsonify({"error": "Callback is missing a task id"}), 400
+
+    # Suno only needs a 200 to stop retrying the callback.
+    return jsonify({"code": 200, "msg": "received"}), 200
+
+
+@app.route("/api/music/status/<task_id>", methods=["GET"])
+def music_status(task_id):
+    """Status of one generation task, served from local state (no upstream call)."""
+    task = music_tracker.status(task_id)
+    if task is None:
+        return jsonify({"error": "Unknown task_id"}), 404
+    return jsonify({"success": True, **task})
+
+
+@app.route("/api/music/status", methods=["GET"])
+def music_status_batch():
+    """Status of several tasks at once: /api/music/status?ids=a,b,c"""
+    task_ids = [task_id for task_id in request.args.get("ids", "").split(",") if task_id]
+    if not task_ids:
+        return jsonify({"error": "ids is required"}), 400
+    if len(task_ids) > MAX_STATUS_IDS:
+        return jsonify({"error": f"At most {MAX_STATUS_IDS} ids per request"}), 400
+    return jsonify({"success": True, "tasks": {task_id: music_tracker.status(task_id) for task_id in task_ids}})
+
 
 # Serve static files from React build
 @app.route("/<path:path>")
@@ -0,0 +1,118 @@
+"""
+Tail-latency benchmark for the Mistral resilience policy.
+
+Starts ``fake_upstreams.FakeMistral`` in-process, points the Mistral client at
+it and drives ``_call_pixtral`` from several threads:
+
+    python bench_resilience.py [--requests 300] [--concurrency 8] [--slow-rate 0.03]
+
+Scenarios: hedging off, hedging on (same slow rate), and a full outage where
+the circuit breaker should start failing fast. Prints p50/p95/p99 per scenario
+together with the number of upstream calls the fake served.
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def run_scenario(name: str, fake, requests_count: int, concurrency: int) -> Dict[str, object]:
+    from ingredients_playlist import _call_pixtral
+    from resilience import CircuitOpenError
+
+    fake.reset_stats()
+    latencies: List[float] = []
+    outcomes = {"ok": 0, "error": 0, "circuit_open": 0}
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        started = time.perf_counter()
+        try:
+            # Distinct prompts keep the open-circuit cache out of the numbers.
+            _call_pixtral("aGVsbG8=", f"bench {name} {i}")
+            outcome = "ok"
+        except CircuitOpenError:
+            outcome = "circuit_open"
+        except Exception:
+            outcome = "error"
+        with lock:
+            outcomes[outcome] += 1
+            latencies.append(time.perf_counter() - started)
+
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests_count)))
+    wall = time.perf_counter() - wall
+
+    return {
+        "scenario": name,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 1),
+        "upstream_calls": fake.stats["requests"],
+        "wall_s": round(wall, 2),
+        **outcomes,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark hedging and circuit breaking against a fake Mistral.")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--base-latency", type=float, default=0.2)
+    parser.add_argument("--slow-rate", type=float, default=0.03)
+    parser.add_argument("--slow-seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    from fake_upstreams import FakeMistral, serve
+
+    fake = FakeMistral(args.base_latency, args.slow_rate, args.slow_seconds)
+    port = _free_port()
+    serve(fake, port, background=True)
+    # Must be set before ingredients_playlist builds its Mistral client.
+    os.environ["MISTRAL_SERVER_URL"] = f"http://127.0.0.1:{port}"
+    os.environ.setdefault("MISTRAL_API_KEY", "fake")
+
+    import ingredients_playlist
+    from resilience import CircuitBreaker, LatencyTracker
+
+    vision = ingredients_playlist.vision_policy
+    # Keep the timeout above the injected slow response so the comparison measures hedging, not timeouts.
+    vision.timeout = args.slow_seconds * 2
+
+    results = []
+    vision.hedge = False
+    results.append(run_scenario("no-hedge", fake, args.requests, args.concurrency))
+
+    vision.hedge = True
+    vision.latency = LatencyTracker()
+    results.append(run_scenario("hedge", fake, args.requests, args.concurrency))
+
+    vision.hedge = False
+    vision.breaker = CircuitBreaker(vision.name, failure_threshold=5, reset_timeout=30.0)
+    fake.slow_rate, fake.fail_rate = 0.0, 1.0
+    results.append(run_scenario("outage", fake, args.requests, args.concurrency))
+
+    columns = ["scenario", "p50_ms", "p95_ms", "p99_ms", "upstream_calls", "ok", "error", "circuit_open", "wall_s"]
+    print("  ".join(f"{column:>14}" for column in columns))
+    for row in results:
+        print("  ".join(f"{row[column]!s:>14}" for column in columns))
+
+
+if __name__ == "__main__":
+    main()
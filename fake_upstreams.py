@@ -0,0 +1,228 @@
+"""
+Local fake upstream servers for development and benchmarks.
+
+    python fake_upstreams.py suno --port 8099 [--complete-after 20] [--drop-callbacks]
+    python fake_upstreams.py mistral --port 8098 [--slow-rate 0.03] [--slow-seconds 3] [--fail-rate 0]
+
+then run the backend with ``SUNO_API_BASE=http://localhost:8099 SUNO_API_KEY=fake`` or
+``MISTRAL_SERVER_URL=http://localhost:8098 MISTRAL_API_KEY=fake``.
+``GET /__stats`` on either fake reports how many calls it served.
+"""
+
+import argparse
+import json
+import random
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+import requests
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    server_version = "FakeUpstream/1.0"
+
+    def log_message(self, format, *args):  # keep benchmark output readable
+        pass
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload: Dict, status: int = 200) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out or a hedged request won; expected under fault injection
+
+
+class FakeSuno:
+    """Suno API stand-in: tasks complete after ``complete_after`` seconds and optionally call back."""
+
+    def __init__(self, complete_after: float = 20.0, drop_callbacks: bool = False):
+        self.complete_after = complete_after
+        self.drop_callbacks = drop_callbacks
+        self.tasks: Dict[str, Dict] = {}
+        self.stats = {"generate": 0, "status": 0, "callbacks_sent": 0}
+        self.lock = threading.Lock()
+
+    def _tracks(self, task_id: str):
+        return [
+            {
+                "id": f"{task_id}-{n}",
+                "title": f"Fake track {n}",
+                "audio_url": f"https://example.invalid/{task_id}-{n}.mp3",
+                "stream_audio_url": f"https://example.invalid/{task_id}-{n}.stream",
+                "image_url": f"https://example.invalid/{task_id}-{n}.jpg",
+                "duration": 120.0,
+            }
+            for n in (1, 2)
+        ]
+
+    def _status(self, task_id: str) -> str:
+        elapsed = time.time() - self.tasks[task_id]["created"]
+        return "SUCCESS" if elapsed >= self.complete_after else "PENDING"
+
+    def _send_callback(self, task_id: str, url: str) -> None:
+        payload = {
+            "code": 200,
+            "msg": "All generated successfully.",
+            "data": {"callbackType": "complete", "task_id": task_id, "data": self._tracks(task_id)},
+        }
+        try:
+            requests.post(url, json=payload, timeout=10)
+            with self.lock:
+                self.stats["callbacks_sent"] += 1
+        except requests.RequestException as err:
+            print(f"fake suno: callback to {url} failed: {err}")
+
+    def handler(self):
+        fake = self
+
+        class Handler(_JSONHandler):
+            def do_POST(self):
+                if self.path != "/api/v1/generate":
+                    return self._send_json({"code": 404, "msg": "not found"}, 404)
+                body = self._read_json()
+                task_id = secrets.token_hex(8)
+                with fake.lock:
+                    fake.stats["generate"] += 1
+                    fake.tasks[task_id] = {"created": time.time(), "prompt": body.get("prompt")}
+                callback_url = body.get("callBackUrl")
+                if callback_url and not fake.drop_callbacks:
+                    timer = threading.Timer(fake.complete_after, fake._send_callback, args=(task_id, callback_url))
+                    timer.daemon = True
+                    timer.start()
+                self._send_json({"code": 200, "msg": "success", "data": {"taskId": task_id}})
+
+            def do_GET(self):
+                if self.path == "/__stats":
+                    with fake.lock:
+                        return self._send_json(dict(fake.stats))
+                if not self.path.startswith("/api/v1/task/"):
+                    return self._send_json({"code": 404, "msg": "not found"}, 404)
+                task_id = self.path.rsplit("/", 1)[-1]
+                with fake.lock:
+                    fake.stats["status"] += 1
+                if task_id not in fake.tasks:
+                    return self._send_json({"code": 404, "msg": "task not found"}, 404)
+                status = fake._status(task_id)
+                response = {"sunoData": fake._tracks(task_id)} if status == "SUCCESS" else None
+                self._send_json({"code": 200, "status": status, "data": {"taskId": task_id, "status": status, "response": response}})
+
+        return Handler
+
+
+class FakeMistral:
+    """
+    Mistral chat completions stand-in with fault injection.
+
+    Each request takes ``base_latency`` (with +/-50% jitter); ``slow_rate`` of them
+    take ``slow_seconds`` instead, and ``fail_rate`` of them return 503.
+    """
+
+    def __init__(self, base_latency: float = 0.2, slow_rate: float = 0.03, slow_seconds: float = 3.0, fail_rate: float = 0.0):
+        self.base_latency = base_latency
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.fail_rate = fail_rate
+        self.stats = {"requests": 0, "slow": 0, "failed": 0}
+        self.lock = threading.Lock()
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            self.stats = {key: 0 for key in self.stats}
+
+    def handler(self):
+        fake = self
+
+        class Handler(_JSONHandler):
+            def do_GET(self):
+                if self.path == "/__stats":
+                    with fake.lock:
+                        return self._send_json(dict(fake.stats))
+                self._send_json({"message": "not found"}, 404)
+
+            def do_POST(self):
+                if self.path != "/v1/chat/completions":
+                    return self._send_json({"message": "not found"}, 404)
+                body = self._read_json()
+                roll = random.random()
+                with fake.lock:
+                    fake.stats["requests"] += 1
+                    slow = roll < fake.slow_rate
+                    failed = not slow and roll < fake.slow_rate + fake.fail_rate
+                    fake.stats["slow"] += slow
+                    fake.stats["failed"] += failed
+
+                time.sleep(fake.slow_seconds if slow else fake.base_latency * random.uniform(0.5, 1.5))
+                if failed:
+                    return self._send_json({"message": "Service unavailable", "type": "service_unavailable"}, 503)
+
+                if (body.get("response_format") or {}).get("type") == "json_object":
+                    content = json.dumps(
+                        {
+                            "dish_name": "Margherita Pizza",
+                            "ingredients": ["tomato", "mozzarella", "basil", "olive oil"],
+                            "cuisine": "Italian",
+                            "mood_tags": ["warm", "comforting"],
+                        }
+                    )
+                else:
+                    content = "1. Bella Ciao – Manu Pilas\n2. That's Amore – Dean Martin"
+                self._send_json(
+                    {
+                        "id": secrets.token_hex(8),
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body.get("model", "fake"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120},
+                    }
+                )
+
+        return Handler
+
+
+def serve(fake, port: int, host: str = "127.0.0.1", background: bool = False) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), fake.handler())
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        print(f"{type(fake).__name__} listening on http://{host}:{server.server_port}")
+        server.serve_forever()
+    return server
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run a local fake upstream server.")
+    sub = parser.add_subparsers(dest="kind", required=True)
+
+    suno = sub.add_parser("suno", help="fake Suno music generation API")
+    suno.add_argument("--port", type=int, default=8099)
+    suno.add_argument("--complete-after", type=float, default=20.0, help="seconds until a task succeeds")
+    suno.add_argument("--drop-callbacks", action="store_true", help="never call back, forcing the poller path")
+
+    mistral = sub.add_parser("mistral", help="fake Mistral chat completions API with slow/failed responses")
+    mistral.add_argument("--port", type=int, default=8098)
+    mistral.add_argument("--base-latency", type=float, default=0.2, help="typical response time in seconds")
+    mistral.add_argument("--slow-rate", type=float, default=0.03, help="fraction of requests that are slow")
+    mistral.add_argument("--slow-seconds", type=float, default=3.0, help="response time of a slow request")
+    mistral.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests that return 503")
+
+    args = parser.parse_args(argv)
+    if args.kind == "suno":
+        serve(FakeSuno(args.complete_after, args.drop_callbacks), args.port)
+    elif args.kind == "mistral":
+        serve(FakeMistral(args.base_latency, args.slow_rate, args.slow_seconds, args.fail_rate), args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
-from ollama import chat
 from pydantic import BaseModel
 import sys
 from typing import Dict, Optional
 
+import tracing
+from ollama_sessions import DEFAULT_HISTORY_MODEL, sessions
+
 
 class FoodInfo(BaseModel):
     food_history: str
@@ -35,10 +37,12 @@ For the dish provided, follow these steps:
 Now, provide the final structured output with your analysis.
 """
 
+sessions.set_system_prompt(REACT_PROMPT)
+
 
 def get_food_history(
     food_name: str,
-    model: str = 'llama3.2:3b',
+    model: str = DEFAULT_HISTORY_MODEL,
     verbose: bool = False
 ) -> Dict[str, str]:
     """
@@ -46,7 +50,7 @@ def get_food_history(
     
     Args:
         food_name (str): Name of the food item to get history for
-        model (str): Ollama model name to use. Default is 'qwen3:8b'.
+        model (str): Ollama model name to use. Defaults to FOOD_HISTORY_MODEL ('llama3.2:3b').
                     Recommended faster models: 'llama3.2:3b', 'qwen2.5:3b', 'phi3:mini'
         verbose (bool): If True, print debug information. Default is False.
     
@@ -69,20 +73,34 @@ def get_food_history(
         print(f"⏳ Sending request to ollama...")
     
     try:
-        response = chat(
+        user_prompt = f'Apply ReAct methodology to provide comprehensive information about: {food_name}'
+        with tracing.span(
+            'ollama.chat',
+            kind='client',
             model=model,
-            messages=[
-                {
-                    'role': 'system',
-                    'content': REACT_PROMPT
-                },
-                {
-                    'role': 'user',
-                    'content': f'Apply ReAct methodology to provide comprehensive information about: {food_name}',
-                },
-            ],
-            format=schema,
-        )
+            payload_bytes=len(REACT_PROMPT) + len(user_prompt),
+        ) as sp:
+            response = sessions.client.chat(
+                model=model,
+                messages=[
+                    {
+                        'role': 'system',
+                        'content': REACT_PROMPT
+                    },
+                    {
+                        'role': 'user',
+                        'content': user_prompt,
+                    },
+                ],
+                format=schema,
+                **sessions.chat_kwargs(model),
+            )
+            sessions.record(model, response)
+            sp.set_attributes(**{
+                'llm.tokens.prompt': getattr(response, 'prompt_eval_count', None),
+                'llm.tokens.completion': getattr(response, 'eval_count', None),
+                'ollama.load_ms': (getattr(response, 'load_duration', None) or 0) / 1e6,
+            })
         
         if verbose:
             print(f"✓ Received response from ollama!")
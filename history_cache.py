@@ -0,0 +1,251 @@
+"""
+Disk-backed store of generated food histories, keyed by dish and model.
+
+Backs the cacheable ``GET /api/food-history/<dish>`` route: each entry keeps the
+history text plus a digest of it, which the route turns into a strong ETag, so
+conditional requests can be answered with ``304`` without touching Ollama.
+Entries live as one JSON file each under ``HISTORY_CACHE_DIR`` and survive
+restarts; recently used entries are also kept in memory. The directory is capped
+at ``HISTORY_CACHE_MAX_ENTRIES`` files and ``HISTORY_CACHE_MAX_BYTES``, evicting
+the least recently used entries first.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import metrics
+import tracing
+
+
+HISTORY_CACHE_DIR = os.getenv("HISTORY_CACHE_DIR", os.path.join("data", "history_cache"))
+# Stored histories older than this are regenerated on the next origin request.
+HISTORY_CACHE_TTL = float(os.getenv("HISTORY_CACHE_TTL", str(30 * 24 * 3600)))
+HISTORY_CACHE_MEMORY_ENTRIES = int(os.getenv("HISTORY_CACHE_MEMORY_ENTRIES", "512"))
+HISTORY_CACHE_MAX_ENTRIES = int(os.getenv("HISTORY_CACHE_MAX_ENTRIES", "5000"))
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Dish names the cacheable route will generate a history for.
+MAX_DISH_LENGTH = 80
+_DISH_PATTERN = re.compile(r"[\w' &,.()-]+")
+
+# Browsers keep a history for HISTORY_MAX_AGE, shared caches (CDN, reverse proxy) for
+# HISTORY_SHARED_MAX_AGE, and both may serve it stale while they revalidate.
+HISTORY_MAX_AGE = int(os.getenv("HISTORY_MAX_AGE", "3600"))
+HISTORY_SHARED_MAX_AGE = int(os.getenv("HISTORY_SHARED_MAX_AGE", "86400"))
+HISTORY_STALE_WHILE_REVALIDATE = int(os.getenv("HISTORY_STALE_WHILE_REVALIDATE", str(7 * 24 * 3600)))
+CACHE_CONTROL = (
+    f"public, max-age={HISTORY_MAX_AGE}, s-maxage={HISTORY_SHARED_MAX_AGE}, "
+    f"stale-while-revalidate={HISTORY_STALE_WHILE_REVALIDATE}, stale-if-error={HISTORY_STALE_WHILE_REVALIDATE}"
+)
+
+# Model label for histories whose provider was picked by the router.
+AUTO_MODEL = "auto"
+
+
+def normalize_dish(dish: str) -> str:
+    """Cache key form of a dish name: "  Chicken  Chowmein " -> "chicken chowmein"."""
+    return re.sub(r"\s+", " ", dish).strip().lower()
+
+
+def clean_dish(dish: str) -> str:
+    """
+    Display form of a requested dish name with whitespace collapsed.
+
+    Raises ValueError for names no dish has (too long, or characters other than
+    letters, digits, spaces and ``'&,.()-``), so they never reach a model.
+    """
+    dish = re.sub(r"\s+", " ", dish).strip()
+    if not dish:
+        raise ValueError("dish is required")
+    if len(dish) > MAX_DISH_LENGTH:
+        raise ValueError(f"dish must be at most {MAX_DISH_LENGTH} characters")
+    if not _DISH_PATTERN.fullmatch(dish):
+        raise ValueError("dish may only contain letters, digits, spaces and ' & , . ( ) -")
+    return dish
+
+
+def content_digest(entry: Dict) -> str:
+    """Stable digest of the parts of an entry a client sees."""
+    content = {key: entry[key] for key in ("food_name", "model", "provider", "history")}
+    canonical = json.dumps(content, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class HistoryCache:
+    def __init__(
+        self,
+        directory: str,
+        ttl: float,
+        memory_entries: int,
+        max_entries: int = HISTORY_CACHE_MAX_ENTRIES,
+        max_bytes: int = HISTORY_CACHE_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Dict]" = OrderedDict()
+        # One lock per key so concurrent misses for a dish generate it once.
+        self._key_locks: Dict[str, threading.Lock] = {}
+        # File path -> size in least-recently-used order, scanned from disk on first use.
+        self._files: "Optional[OrderedDict[str, int]]" = None
+        self._file_bytes = 0
+
+    @staticmethod
+    def _key(dish: str, model: Optional[str]) -> str:
+        return f"{model or AUTO_MODEL}|{normalize_dish(dish)}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _remember(self, key: str, entry: Dict) -> None:
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _scan(self) -> None:
+        """Index the files already on disk, oldest first. Caller holds ``_lock``."""
+        files = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            names = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, os.path.join(self.directory, name), stat.st_size))
+        self._files = OrderedDict((path, size) for _, path, size in sorted(files))
+        self._file_bytes = sum(self._files.values())
+
+    def _track(self, path: str, size: Optional[int] = None) -> None:
+        """Mark ``path`` as recently used (``size`` after a write) and evict past the caps."""
+        evicted = []
+        with self._lock:
+            if self._files is None:
+                self._scan()
+            if size is not None:
+                self._file_bytes += size - self._files.get(path, 0)
+                self._files[path] = size
+            elif path not in self._files:
+                return
+            self._files.move_to_end(path)
+            while self._files and (len(self._files) > self.max_entries or self._file_bytes > self.max_bytes):
+                old_path, old_size = self._files.popitem(last=False)
+                self._file_bytes -= old_size
+                evicted.append(old_path)
+            if evicted:
+                # Drop the memory copies too, or they would outlive their files.
+                stale = [key for key in self._memory if self._path(key) in evicted]
+                for key in stale:
+                    del self._memory[key]
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+        if evicted:
+            metrics.incr("history_cache_evictions_total", len(evicted))
+
+    def get(self, dish: str, model: Optional[str] = None) -> Optional[Dict]:
+        """Fresh stored entry for ``dish``/``model``, or None."""
+        key = self._key(dish, model)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is None:
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as handle:
+                    entry = json.load(handle)
+            except (OSError, ValueError):
+                return None
+            self._remember(key, entry)
+        if time.time() - entry["generated_at"] > self.ttl:
+            return None
+        self._track(self._path(key))
+        return entry
+
+    def put(self, dish: str, model: Optional[str], provider: str, history: Dict[str, str]) -> Dict:
+        key = self._key(dish, model)
+        entry = {
+            "food_name": dish.strip(),
+            "model": model or AUTO_MODEL,
+            "provider": provider,
+            "history": history,
+            "generated_at": time.time(),
+        }
+        entry["digest"] = content_digest(entry)
+        self._remember(key, entry)
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as handle:
+                json.dump(entry, handle, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self._track(path, os.path.getsize(path))
+        except OSError as err:
+            print(f"Warning: could not persist food history for '{dish}': {err}")
+        return entry
+
+    def get_or_create(
+        self,
+        dish: str,
+        model: Optional[str],
+        generate: Callable[[], Tuple[Dict[str, str], str]],
+    ) -> Dict:
+        """
+        Stored entry for ``dish``/``model``, calling ``generate()`` -> (history, provider)
+        on a miss. Concurrent misses for the same key wait for a single generation.
+        """
+        span = tracing.current_span()
+        entry = self.get(dish, model)
+        if entry is not None:
+            metrics.incr("history_cache_total", result="hit")
+            span.set_attributes(**{"cache.hit": True, "cache.result": "hit"})
+            return entry
+
+        key = self._key(dish, model)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                entry = self.get(dish, model)
+                if entry is not None:
+                    metrics.incr("history_cache_total", result="coalesced")
+                    span.set_attributes(**{"cache.hit": True, "cache.result": "coalesced"})
+                    return entry
+                metrics.incr("history_cache_total", result="miss")
+                span.set_attributes(**{"cache.hit": False, "cache.result": "miss"})
+                history, provider = generate()
+                return self.put(dish, model, provider, history)
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = {"memory_entries": len(self._memory)}
+            if self._files is not None:
+                stats.update(disk_entries=len(self._files), disk_bytes=self._file_bytes)
+            return stats
+
+
+history_cache = HistoryCache(HISTORY_CACHE_DIR, HISTORY_CACHE_TTL, HISTORY_CACHE_MEMORY_ENTRIES)
+
+metrics.register_collector(lambda: {"history_cache": history_cache.stats()})
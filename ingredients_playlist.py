@@ -1,11 +1,21 @@
 import base64
-import json
+import hashlib
 import os
-from typing import Dict, Optional
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
 
 import requests
 from dotenv import load_dotenv
 from mistralai import Mistral
+from pydantic import BaseModel, ValidationError, field_validator
+
+import metrics
+import tracing
+from playlist_index import MOOD_TAGS, record_llm_playlist
+from resilience import CircuitOpenError, policy
 
 load_dotenv()
 
@@ -16,7 +26,72 @@ if not api_key:
 IMAGE_MODEL = "pixtral-12b-2409"
 TEXT_MODEL = "mistral-small-latest"
 
-client = Mistral(api_key=api_key)
+# "llm" only uses LLM providers, "local" always uses the playlist index, "auto" asks
+# the LLMs and drops to the local index when they are slow, failing or over budget.
+# Applied by provider_router.generate_playlist.
+PLAYLIST_MODE = os.getenv("PLAYLIST_MODE", "auto").lower()
+PLAYLIST_LLM_TIMEOUT_MS = int(os.getenv("PLAYLIST_LLM_TIMEOUT_MS", "8000"))
+PLAYLIST_LLM_BUDGET_PER_HOUR = int(os.getenv("PLAYLIST_LLM_BUDGET_PER_HOUR", "0"))  # 0 = unlimited
+
+VISION_TIMEOUT_MS = int(os.getenv("VISION_TIMEOUT_MS", "20000"))
+# Send a second identical request once the first is slower than the recent p95.
+MISTRAL_HEDGE = os.getenv("MISTRAL_HEDGE", "0") == "1"
+VISION_CACHE_SIZE = 256
+
+# MISTRAL_SERVER_URL lets benchmarks point the client at fake_upstreams.py.
+client = Mistral(api_key=api_key, server_url=os.getenv("MISTRAL_SERVER_URL") or None)
+
+vision_policy = policy("mistral-vision", timeout=VISION_TIMEOUT_MS / 1000, hedge=MISTRAL_HEDGE)
+text_policy = policy("mistral-text", timeout=PLAYLIST_LLM_TIMEOUT_MS / 1000, hedge=MISTRAL_HEDGE)
+
+# Recent vision answers by image + prompt, served while the vision circuit is open.
+_vision_cache: "OrderedDict[str, str]" = OrderedDict()
+_vision_cache_lock = threading.Lock()
+
+# Upstream vision calls vs analyses, and how each analysis' JSON was recovered.
+_vision_stats = {"analyses": 0, "calls": 0, "valid": 0, "repaired": 0, "fallback": 0, "degraded": 0}
+_vision_stats_lock = threading.Lock()
+
+
+def _count_vision(**increments: int) -> None:
+    with _vision_stats_lock:
+        for key, value in increments.items():
+            _vision_stats[key] += value
+
+
+def vision_stats() -> Dict[str, float]:
+    with _vision_stats_lock:
+        stats = dict(_vision_stats)
+    analyses = stats["analyses"] or 1
+    stats["calls_per_analysis"] = round(stats["calls"] / analyses, 3)
+    stats["repair_rate"] = round(stats["repaired"] / analyses, 3)
+    stats["fallback_rate"] = round(stats["fallback"] / analyses, 3)
+    return stats
+
+
+metrics.register_collector(lambda: {"vision": vision_stats()})
+
+
+class DishAnalysis(BaseModel):
+    dish_name: str = "Unknown"
+    ingredients: List[str] = []
+    cuisine: str = ""
+    mood_tags: List[str] = []
+
+    @field_validator("dish_name", "cuisine", mode="before")
+    @classmethod
+    def _text(cls, value):
+        return str(value or "").strip()
+
+    @field_validator("ingredients", "mood_tags", mode="before")
+    @classmethod
+    def _string_list(cls, value):
+        # Models sometimes answer "a, b, c" where a list was asked for.
+        if value is None:
+            return []
+        if isinstance(value, str):
+            value = re.split(r"[,\n;]", value)
+        return [str(item).strip() for item in value if str(item).strip()]
 
 
 def getimages():
@@ -41,38 +116,154 @@ def _call_pixtral(image_data: str, prompt: str, *, response_format: Optional[Dic
     if response_format is not None:
         kwargs["response_format"] = response_format
 
-    chat_response = client.chat.complete(**kwargs)
-    return chat_response.choices[0].message.content
+    def attempt(timeout: float) -> str:
+        # Counted per upstream request, so hedged duplicates show up and cache hits don't.
+        _count_vision(calls=1)
+        with tracing.span(
+            "mistral.chat",
+            kind="client",
+            model=IMAGE_MODEL,
+            payload_bytes=len(image_data) + len(prompt),
+            json_mode=response_format is not None,
+        ) as sp:
+            chat_response = client.chat.complete(**kwargs, timeout_ms=int(timeout * 1000))
+            tracing.record_usage(sp, chat_response.usage)
+        return chat_response.choices[0].message.content
+
+    cache_key = hashlib.sha256(f"{prompt}|{response_format}|{image_data}".encode("utf-8")).hexdigest()
+    try:
+        content = vision_policy.call(attempt)
+    except CircuitOpenError:
+        with _vision_cache_lock:
+            cached = _vision_cache.get(cache_key)
+        tracing.current_span().set_attribute("cache.hit", cached is not None)
+        if cached is None:
+            raise
+        return cached
+
+    with _vision_cache_lock:
+        _vision_cache[cache_key] = content
+        _vision_cache.move_to_end(cache_key)
+        while len(_vision_cache) > VISION_CACHE_SIZE:
+            _vision_cache.popitem(last=False)
+    return content
 
 
-def analyze_food_image(image_data: str) -> Dict[str, str]:
-    prompt = (
-        "You are a culinary expert. Identify the primary prepared dish in this image and list the most common "
-        "ingredients used to make it. Respond strictly as a JSON object with the keys "
-        '"dish_name" (string) and "ingredients" (comma-separated string). '
-        'If you are unsure, set "dish_name" to "Unknown" and include your best guess of ingredients.'
-    )
+VISION_PROMPT = (
+    "You are a culinary expert. Identify the primary prepared dish in this image. "
+    "Respond strictly as one JSON object with the keys "
+    '"dish_name" (string), "ingredients" (array of the most common ingredient names), '
+    '"cuisine" (string, e.g. "Italian") and "mood_tags" (array of 2-4 words describing the mood of the dish, '
+    f"chosen from: {', '.join(MOOD_TAGS)}). "
+    'If you are unsure, set "dish_name" to "Unknown" and include your best guess of ingredients.'
+)
 
-    raw_response = _call_pixtral(image_data, prompt, response_format={"type": "json_object"})
+_SMART_QUOTES = str.maketrans({"\u201c": '"', "\u201d": '"', "\u2018": "'", "\u2019": "'"})
 
+
+def repair_json(raw: str) -> str:
+    """
+    Best-effort local fix-up of a malformed JSON object from the model.
+
+    Strips Markdown fences and surrounding prose, normalises smart quotes, drops
+    trailing commas and closes strings, arrays and objects cut off by truncation.
+    """
+    text = (raw or "").translate(_SMART_QUOTES).strip()
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    start = text.find("{")
+    if start == -1:
+        return text
+    text = text[start:]
+
+    # Walk the text once, tracking strings and open brackets: stop where the top-level
+    # object closes, and drop commas that directly precede a closer (never inside strings).
+    out: List[str] = []
+    closers: List[str] = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            out.append(char)
+            if closers:
+                closers.pop()
+            if not closers:
+                return "".join(out)
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        out.append(char)
+
+    # Truncated: close the open string, drop a dangling key, then close what is still open.
+    text = "".join(out)
+    if in_string:
+        text += '"'
+    if closers and closers[-1] == "}":
+        # {"a": 1, "b"  ->  {"a": 1
+        text = re.sub(r'([{,])\s*"[^"]*"\s*:?\s*$', r"\1", text)
+    return text.rstrip().rstrip(",") + "".join(reversed(closers))
+
+
+def parse_dish_analysis(raw: str) -> Tuple[DishAnalysis, str]:
+    """Validate the vision answer, repairing it locally if needed. Returns (analysis, "valid"|"repaired"|"fallback")."""
     try:
-        parsed = json.loads(raw_response)
-    except json.JSONDecodeError:
-        parsed = {"dish_name": "Unknown", "ingredients": ""}
+        return DishAnalysis.model_validate_json(raw), "valid"
+    except ValidationError:
+        pass
+    try:
+        return DishAnalysis.model_validate_json(repair_json(raw)), "repaired"
+    except ValidationError:
+        return DishAnalysis(), "fallback"
 
-    dish_name = parsed.get("dish_name") or "Unknown"
-    ingredients = parsed.get("ingredients") or ""
 
-    return {"dish_name": dish_name.strip(), "ingredients": ingredients.strip()}
+def analyze_food_image(image_data: str) -> Dict[str, object]:
+    """
+    Identify the dish in one schema-validated Pixtral call.
 
+    Returns ``dish_name``, ``ingredients`` (comma-separated string), ``ingredient_list``,
+    ``cuisine`` and ``mood_tags``. Malformed JSON is repaired locally rather than
+    sending the image again.
+    """
+    _count_vision(analyses=1)
+    try:
+        raw_response = _call_pixtral(image_data, VISION_PROMPT, response_format={"type": "json_object"})
+    except CircuitOpenError as err:
+        # Degrade instead of failing: the playlist index can still work without ingredients.
+        print(f"Warning: {err}; returning a degraded analysis")
+        metrics.incr("vision_degraded_total")
+        _count_vision(degraded=1)
+        return {"dish_name": "Unknown", "ingredients": "", "ingredient_list": [], "cuisine": "", "mood_tags": [], "degraded": True}
+
+    analysis, outcome = parse_dish_analysis(raw_response)
+    _count_vision(**{outcome: 1})
+    metrics.incr("vision_parse_total", result=outcome)
+    tracing.current_span().set_attribute("vision.parse", outcome)
+    if outcome == "fallback":
+        print("Warning: could not parse the vision response, even after repair")
 
-def getproductdescription(image_data, prompt=None):
-    message_data = prompt or "Give me a list of ingredients for this image. Only return the ingredients, no other text."
-    response_text = _call_pixtral(image_data, message_data)
-    return response_text
+    return {
+        "dish_name": analysis.dish_name or "Unknown",
+        "ingredients": ", ".join(analysis.ingredients),
+        "ingredient_list": analysis.ingredients,
+        "cuisine": analysis.cuisine,
+        "mood_tags": [tag.lower() for tag in analysis.mood_tags],
+    }
 
 
-def get_playlist_from_ingredients(ingredients: str):
+def _playlist_prompt(ingredients: str, avoid: Optional[List[str]] = None, moods: Optional[List[str]] = None) -> str:
     prompt = f"""
     You are a contemporary music curator.
     Based on these food ingredients: {ingredients}
@@ -80,22 +271,60 @@ def get_playlist_from_ingredients(ingredients: str):
     Suggest a playlist of 8–10 real songs that match the mood/flavors.
     Format as a simple numbered list with "Song – Artist".
     """
+    if moods:
+        prompt += f"The dish feels {', '.join(moods)}; pick songs with that mood.\n"
+    if avoid:
+        prompt += f"Do not include any of these songs: {', '.join(avoid)}.\n"
+    return prompt
+
+
+_llm_calls = deque()
+_llm_calls_lock = threading.Lock()
 
+
+def take_llm_budget() -> bool:
+    """Consume one LLM playlist call from the hourly budget; False when it is spent."""
+    if PLAYLIST_LLM_BUDGET_PER_HOUR <= 0:
+        return True
+    now = time.monotonic()
+    with _llm_calls_lock:
+        while _llm_calls and now - _llm_calls[0] > 3600:
+            _llm_calls.popleft()
+        if len(_llm_calls) >= PLAYLIST_LLM_BUDGET_PER_HOUR:
+            return False
+        _llm_calls.append(now)
+        return True
+
+
+def get_playlist_from_llm(
+    ingredients: str,
+    timeout_ms: Optional[int] = None,
+    avoid: Optional[List[str]] = None,
+    moods: Optional[List[str]] = None,
+) -> str:
+    prompt = _playlist_prompt(ingredients, avoid, moods)
     messages = [{"role": "user", "content": prompt}]
 
-    resp = client.chat.complete(
-        model=TEXT_MODEL,
-        messages=messages,
-        temperature=0.6,
-    )
+    def attempt(timeout: float) -> str:
+        with tracing.span("mistral.chat", kind="client", model=TEXT_MODEL, payload_bytes=len(prompt)) as sp:
+            resp = client.chat.complete(
+                model=TEXT_MODEL,
+                messages=messages,
+                temperature=0.6,
+                timeout_ms=int(timeout * 1000),
+            )
+            tracing.record_usage(sp, resp.usage)
+        return resp.choices[0].message.content
 
-    playlist = resp.choices[0].message.content
+    playlist = text_policy.call(attempt, timeout=timeout_ms / 1000 if timeout_ms else None)
+    record_llm_playlist(ingredients, playlist, moods=moods)
     return playlist
 
+
 # # Example use:
 # ingredients_output = "tomato, basil, garlic, olive oil, parmesan"
-# #playlist = get_playlist_from_ingredients(ingredients_output)
-# ingredients = getproductdescription(getimages())
-# playlist = get_playlist_from_ingredients(ingredients)
+# #playlist = get_playlist_from_llm(ingredients_output)
+# analysis = analyze_food_image(getimages())
+# playlist = get_playlist_from_llm(analysis["ingredients"], moods=analysis["mood_tags"])
 # print("\nRecommended Playlist:\n")
 # print(playlist)
\ No newline at end of file
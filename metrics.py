@@ -0,0 +1,51 @@
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_gauges: Dict[str, float] = {}
+_collectors: List[Callable[[], Dict[str, object]]] = []
+
+
+def _key(name: str, labels: Dict[str, object]) -> str:
+    if not labels:
+        return name
+    rendered = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+    return f"{name}{{{rendered}}}"
+
+
+def incr(name: str, value: float = 1, **labels) -> None:
+    """Increment a counter, e.g. incr("scheduler_shed_total", lane="bulk")."""
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    """Set a gauge to its latest value."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def register_collector(collector: Callable[[], Dict[str, object]]) -> None:
+    """Register a callable whose dict output is merged into every snapshot."""
+    with _lock:
+        _collectors.append(collector)
+
+
+def snapshot() -> Dict[str, object]:
+    """Return all counters, gauges and collector output as a JSON-friendly dict."""
+    with _lock:
+        data: Dict[str, object] = {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+        }
+        collectors = list(_collectors)
+
+    for collector in collectors:
+        try:
+            data.update(collector())
+        except Exception as err:  # pragma: no cover - a broken collector must not break /api/metrics
+            print(f"Warning: metrics collector failed: {err}")
+    return data
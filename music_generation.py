@@ -0,0 +1,306 @@
+"""
+Suno music generation tracked from inside the backend.
+
+Generation jobs are submitted with a ``callBackUrl`` pointing at
+``/generate-music-callback``; the callback records completion in local state.
+A background poller covers missed callbacks: each cycle it gathers every
+outstanding task that is due, polls them together over one keep-alive session,
+and backs each task off exponentially. Status requests from clients are served
+from local state only, so they never trigger an upstream call.
+
+Point ``SUNO_API_BASE`` at ``python fake_upstreams.py suno`` to run against a
+local fake server.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+from dotenv import load_dotenv
+
+import metrics
+import tracing
+
+load_dotenv()
+
+SUNO_API_KEY = os.getenv("SUNO_API_KEY")
+SUNO_API_BASE = os.getenv("SUNO_API_BASE", "https://api.sunoapi.org").rstrip("/")
+SUNO_MODEL = os.getenv("SUNO_MODEL", "V3_5")
+SUNO_CALLBACK_URL = os.getenv("SUNO_CALLBACK_URL", "https://dishcovery-g8j1.onrender.com/generate-music-callback")
+# Shared secret appended to the callback URL so forged callbacks can be rejected.
+SUNO_CALLBACK_TOKEN = os.getenv("SUNO_CALLBACK_TOKEN", "")
+
+POLL_INITIAL_DELAY = float(os.getenv("SUNO_POLL_INITIAL_DELAY", "15"))
+POLL_MAX_DELAY = float(os.getenv("SUNO_POLL_MAX_DELAY", "120"))
+POLL_BACKOFF = 2.0
+POLL_BATCH_SIZE = int(os.getenv("SUNO_POLL_BATCH_SIZE", "20"))
+# Tasks due within this window ride along with the current batch instead of waking the poller again.
+POLL_COALESCE_WINDOW = 1.0
+POLL_CONCURRENCY = 4
+TASK_TIMEOUT = float(os.getenv("SUNO_TASK_TIMEOUT", "900"))
+FINISHED_TASK_RETENTION = 3600.0
+# Callbacks for ids we never submitted are recorded but never polled, and capped.
+MAX_UNTRACKED_TASKS = 1000
+# Upper bound on ids per /api/music/status?ids= request.
+MAX_STATUS_IDS = 50
+
+PENDING = "pending"
+COMPLETE = "complete"
+FAILED = "failed"
+
+_COMPLETE_STATUSES = {"SUCCESS", "COMPLETE", "COMPLETED"}
+_FAILED_MARKERS = ("FAIL", "ERROR")
+
+
+def normalize_status(raw: Optional[str]) -> str:
+    """Map Suno's task states (PENDING, FIRST_SUCCESS, SUCCESS, *_FAILED, ...) onto pending/complete/failed."""
+    value = (raw or "").upper()
+    if value in _COMPLETE_STATUSES:
+        return COMPLETE
+    if any(marker in value for marker in _FAILED_MARKERS):
+        return FAILED
+    return PENDING
+
+
+def _extract_tracks(data) -> List[Dict[str, object]]:
+    """Pull the per-track fields we serve out of a callback or status payload."""
+    if isinstance(data, dict):
+        data = data.get("sunoData") or data.get("data") or ([data] if data.get("audio_url") or data.get("audioUrl") else [])
+    tracks = []
+    for item in data or []:
+        if not isinstance(item, dict):
+            continue
+        tracks.append(
+            {
+                "id": item.get("id"),
+                "title": item.get("title"),
+                "audio_url": item.get("audio_url") or item.get("audioUrl"),
+                "stream_audio_url": item.get("stream_audio_url") or item.get("streamAudioUrl"),
+                "image_url": item.get("image_url") or item.get("imageUrl"),
+                "duration": item.get("duration"),
+            }
+        )
+    return tracks
+
+
+class SunoClient:
+    def __init__(self, api_key: Optional[str], base_url: str):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def _headers(self) -> Dict[str, str]:
+        if not self.api_key:
+            raise RuntimeError("SUNO_API_KEY not set. Put it in .env or environment.")
+        return {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+    def generate(self, prompt: str, instrumental: bool = False, model: str = SUNO_MODEL) -> str:
+        callback_url = SUNO_CALLBACK_URL
+        if SUNO_CALLBACK_TOKEN:
+            callback_url += ("&" if "?" in callback_url else "?") + f"token={SUNO_CALLBACK_TOKEN}"
+
+        payload = {
+            "prompt": prompt,
+            "customMode": False,
+            "instrumental": instrumental,
+            "model": model,
+            "callBackUrl": callback_url,
+        }
+        with tracing.span("suno.generate", kind="client", model=model, payload_bytes=len(prompt)):
+            response = self.session.post(f"{self.base_url}/api/v1/generate", json=payload, headers=self._headers(), timeout=30)
+        response.raise_for_status()
+        result = response.json()
+
+        task_id = (result.get("data") or {}).get("taskId")
+        if result.get("code", 200) != 200 or not task_id:
+            raise RuntimeError(f"Suno generate failed: {result.get('msg') or result}")
+        return task_id
+
+    def get_status(self, task_id: str) -> Dict[str, object]:
+        with tracing.span("suno.status", kind="client", task_id=task_id):
+            response = self.session.get(f"{self.base_url}/api/v1/task/{task_id}", headers=self._headers(), timeout=15)
+        response.raise_for_status()
+        result = response.json()
+
+        data = result.get("data") or {}
+        raw_status = result.get("status") or data.get("status")
+        tracks = _extract_tracks(data.get("response") or data)
+        audio_url = result.get("audio_url") or data.get("audio_url") or data.get("url")
+        if audio_url and not tracks:
+            tracks = [{"id": None, "title": None, "audio_url": audio_url, "stream_audio_url": None, "image_url": None, "duration": None}]
+        return {"status": normalize_status(raw_status), "raw_status": raw_status, "tracks": tracks}
+
+
+class MusicTaskTracker:
+    """Local state for generation tasks plus the batched, backed-off status poller."""
+
+    def __init__(self, client: SunoClient):
+        self.client = client
+        self._cond = threading.Condition()
+        self._tasks: Dict[str, Dict[str, object]] = {}
+        self._poller: Optional[threading.Thread] = None
+        self._pool = ThreadPoolExecutor(max_workers=POLL_CONCURRENCY, thread_name_prefix="suno-poll")
+
+    # ------------------------------------------------------------------
+    # Client-facing operations
+    # ------------------------------------------------------------------
+    def submit(self, prompt: str, instrumental: bool = False) -> Dict[str, object]:
+        task_id = self.client.generate(prompt, instrumental=instrumental)
+        now = time.time()
+        task = {
+            "task_id": task_id,
+            "status": PENDING,
+            "raw_status": "PENDING",
+            "prompt": prompt,
+            "tracks": [],
+            "created_at": now,
+            "updated_at": now,
+            "updated_by": "submit",
+            "polls": 0,
+            "tracked": True,
+            "poll_delay": POLL_INITIAL_DELAY,
+            "next_poll_at": time.monotonic() + POLL_INITIAL_DELAY,
+        }
+        with self._cond:
+            self._tasks[task_id] = task
+            self._ensure_poller()
+            self._cond.notify()
+        metrics.incr("music_tasks_submitted_total")
+        return self._public(task)
+
+    def status(self, task_id: str) -> Optional[Dict[str, object]]:
+        with self._cond:
+            task = self._tasks.get(task_id)
+            return self._public(task) if task else None
+
+    def record_callback(self, payload: Dict[str, object]) -> Optional[str]:
+        """
+        Apply a Suno callback. Suno sends ``callbackType`` text -> first -> complete
+        (or error) with the tracks generated so far. Returns the task id, if any.
+        """
+        data = payload.get("data") or {}
+        task_id = data.get("task_id") or data.get("taskId")
+        if not task_id:
+            return None
+
+        callback_type = (data.get("callbackType") or "").lower()
+        if callback_type == "complete":
+            status, raw = COMPLETE, "SUCCESS"
+        elif callback_type == "error" or payload.get("code", 200) != 200:
+            status, raw = FAILED, payload.get("msg") or "ERROR"
+        else:
+            status, raw = PENDING, callback_type.upper() or "PENDING"
+
+        self._apply(task_id, status, raw, _extract_tracks(data.get("data")), source="callback")
+        metrics.incr("music_callbacks_total", type=callback_type or "unknown")
+        return task_id
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            counts = {PENDING: 0, COMPLETE: 0, FAILED: 0}
+            for task in self._tasks.values():
+                counts[task["status"]] += 1
+            return counts
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _public(task: Dict[str, object]) -> Dict[str, object]:
+        return {
+            key: task[key]
+            for key in ("task_id", "status", "raw_status", "tracks", "created_at", "updated_at", "updated_by", "polls")
+        }
+
+    def _apply(self, task_id: str, status: str, raw_status: str, tracks: List[Dict[str, object]], source: str) -> None:
+        with self._cond:
+            task = self._tasks.get(task_id)
+            if task is None:
+                # Callback for a task submitted by another worker or before a restart. The
+                # callback endpoint may be unauthenticated, so these are never polled upstream.
+                if sum(1 for t in self._tasks.values() if not t["tracked"]) >= MAX_UNTRACKED_TASKS:
+                    metrics.incr("music_callbacks_dropped_total")
+                    return
+                now = time.time()
+                task = self._tasks[task_id] = {
+                    "task_id": task_id, "prompt": None, "created_at": now, "polls": 0, "tracked": False,
+                    "poll_delay": POLL_INITIAL_DELAY, "next_poll_at": float("inf"),
+                }
+            elif task.get("status") in (COMPLETE, FAILED):
+                return  # terminal states are final; late or duplicate updates are ignored
+            task.update(status=status, raw_status=raw_status, updated_at=time.time(), updated_by=source)
+            if tracks:
+                task["tracks"] = tracks
+            task.setdefault("tracks", [])
+
+    def _ensure_poller(self) -> None:
+        if self._poller is None or not self._poller.is_alive():
+            self._poller = threading.Thread(target=self._poll_loop, name="suno-poller", daemon=True)
+            self._poller.start()
+
+    def _due_tasks(self) -> List[str]:
+        now = time.monotonic()
+        if not any(task["status"] == PENDING and task["next_poll_at"] <= now for task in self._tasks.values()):
+            return []
+        due = [
+            task_id for task_id, task in self._tasks.items()
+            if task["status"] == PENDING and task["next_poll_at"] <= now + POLL_COALESCE_WINDOW
+        ]
+        due.sort(key=lambda task_id: self._tasks[task_id]["next_poll_at"])
+        return due[:POLL_BATCH_SIZE]
+
+    def _next_wakeup(self) -> Optional[float]:
+        pending = [task["next_poll_at"] for task in self._tasks.values() if task["status"] == PENDING and task["tracked"]]
+        return max(0.0, min(pending) - time.monotonic()) if pending else None
+
+    def _prune(self) -> None:
+        now = time.time()
+        for task_id, task in list(self._tasks.items()):
+            if task["status"] == PENDING and now - task["created_at"] > TASK_TIMEOUT:
+                task.update(status=FAILED, raw_status="TIMEOUT", updated_at=now, updated_by="poller")
+            elif task["status"] != PENDING and now - task["updated_at"] > FINISHED_TASK_RETENTION:
+                del self._tasks[task_id]
+
+    def _poll_loop(self) -> None:
+        while True:
+            with self._cond:
+                self._prune()
+                batch = self._due_tasks()
+                while not batch:
+                    self._cond.wait(self._next_wakeup())
+                    self._prune()
+                    batch = self._due_tasks()
+            self.poll_once(batch)
+
+    def poll_once(self, task_ids: List[str]) -> None:
+        """Poll one batch of task ids and reschedule each with exponential backoff."""
+        metrics.incr("music_poll_batches_total")
+        results = list(zip(task_ids, self._pool.map(self._safe_status, task_ids)))
+
+        for task_id, result in results:
+            metrics.incr("music_polls_total")
+            if result is not None:
+                self._apply(task_id, result["status"], result["raw_status"], result["tracks"], source="poller")
+            with self._cond:
+                task = self._tasks.get(task_id)
+                if task is None:
+                    continue
+                task["polls"] += 1
+                task["next_poll_at"] = time.monotonic() + task["poll_delay"]
+                task["poll_delay"] = min(task["poll_delay"] * POLL_BACKOFF, POLL_MAX_DELAY)
+
+    def _safe_status(self, task_id: str) -> Optional[Dict[str, object]]:
+        try:
+            return self.client.get_status(task_id)
+        except Exception as err:
+            metrics.incr("music_poll_errors_total")
+            print(f"Warning: could not poll Suno task '{task_id}': {err}")
+            return None
+
+
+tracker = MusicTaskTracker(SunoClient(SUNO_API_KEY, SUNO_API_BASE))
+
+metrics.register_collector(lambda: {"music_tasks": tracker.stats()})
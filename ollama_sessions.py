@@ -0,0 +1,172 @@
+"""
+Managed Ollama sessions for the food-history models.
+
+Configured models are preloaded at startup and pinned with a keep-alive policy so
+users never pay a cold load after a quiet period. Every call for a model uses the
+same options as its warm-up, and the fixed system prompt is sent as the first
+message each time, so Ollama can reuse the KV cache it already holds for that
+prefix instead of re-evaluating ~400 tokens of instructions per request.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Union
+
+import ollama
+
+import metrics
+import tracing
+from scheduler import PREFETCH, SchedulerOverloaded, scheduler
+
+
+DEFAULT_HISTORY_MODEL = os.getenv("FOOD_HISTORY_MODEL", "llama3.2:3b")
+
+# Models to preload and pin. Defaults to the single history model so the API and
+# the analyze path share one resident model instead of swapping two.
+OLLAMA_MODELS = [m.strip() for m in os.getenv("OLLAMA_MODELS", DEFAULT_HISTORY_MODEL).split(",") if m.strip()]
+
+
+def parse_keep_alive(value: str) -> Union[int, float, str]:
+    """
+    Turn an env keep-alive into what Ollama accepts.
+
+    Bare numbers are seconds and must be sent as JSON numbers: Ollama parses
+    strings with Go's ParseDuration, which rejects "-1" for missing a unit.
+    """
+    value = value.strip()
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+# -1 keeps a model loaded until Ollama restarts; any Ollama duration ("30m", "2h") also works.
+OLLAMA_KEEP_ALIVE = parse_keep_alive(os.getenv("OLLAMA_KEEP_ALIVE", "-1"))
+# Models requested ad hoc (not in OLLAMA_MODELS) get Ollama's usual idle timeout.
+OLLAMA_ADHOC_KEEP_ALIVE = parse_keep_alive(os.getenv("OLLAMA_ADHOC_KEEP_ALIVE", "5m"))
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+# Bound on one history call; warm-up may include a cold load from disk, so it gets longer.
+OLLAMA_TIMEOUT_MS = int(os.getenv("OLLAMA_TIMEOUT_MS", "60000"))
+OLLAMA_WARM_TIMEOUT_MS = int(os.getenv("OLLAMA_WARM_TIMEOUT_MS", "300000"))
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "1") != "0"
+
+# A load_duration above this means the weights were (re)loaded rather than already resident.
+COLD_LOAD_THRESHOLD_MS = 250.0
+
+
+class OllamaSessionManager:
+    def __init__(
+        self,
+        models: List[str],
+        keep_alive: Union[int, float, str],
+        adhoc_keep_alive: Union[int, float, str],
+        num_ctx: int,
+    ):
+        self.models = models
+        self.keep_alive = keep_alive
+        self.adhoc_keep_alive = adhoc_keep_alive
+        self.num_ctx = num_ctx
+        # Clients honour OLLAMA_HOST like the module-level ollama functions.
+        self.client = ollama.Client(timeout=OLLAMA_TIMEOUT_MS / 1000)
+        self._warm_client = ollama.Client(timeout=OLLAMA_WARM_TIMEOUT_MS / 1000)
+        self._system_prompt: Optional[str] = None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def set_system_prompt(self, prompt: str) -> None:
+        """Register the fixed system prompt that warm-up primes into the KV cache."""
+        self._system_prompt = prompt
+
+    def chat_kwargs(self, model: str) -> Dict[str, object]:
+        """
+        Keep-alive and options for a chat call.
+
+        Options must match the warm-up exactly: changing e.g. num_ctx forces Ollama
+        to reload the model and throws the cached prefix away.
+        """
+        return {
+            "keep_alive": self.keep_alive if model in self.models else self.adhoc_keep_alive,
+            "options": {"num_ctx": self.num_ctx},
+        }
+
+    def record(self, model: str, response) -> None:
+        """Record load and prompt-eval timings from an ollama chat response."""
+        load_ms = (getattr(response, "load_duration", None) or 0) / 1e6
+        prompt_tokens = getattr(response, "prompt_eval_count", None) or 0
+        prompt_ms = (getattr(response, "prompt_eval_duration", None) or 0) / 1e6
+        cold = load_ms >= COLD_LOAD_THRESHOLD_MS
+
+        with self._lock:
+            stats = self._stats.setdefault(
+                model,
+                {"cold_loads": 0, "cold_load_ms_total": 0.0, "cold_load_ms_last": 0.0,
+                 "warm_calls": 0, "warm_load_ms_total": 0.0,
+                 "prompt_tokens_total": 0, "prompt_eval_ms_total": 0.0},
+            )
+            if cold:
+                stats["cold_loads"] += 1
+                stats["cold_load_ms_total"] += load_ms
+                stats["cold_load_ms_last"] = load_ms
+            else:
+                stats["warm_calls"] += 1
+                stats["warm_load_ms_total"] += load_ms
+            stats["prompt_tokens_total"] += prompt_tokens
+            stats["prompt_eval_ms_total"] += prompt_ms
+
+        metrics.incr("ollama_loads_total", model=model, kind="cold" if cold else "warm")
+        tracing.current_span().set_attributes(**{"ollama.cold_load": cold, "ollama.prompt_eval_ms": prompt_ms})
+
+    def warm(self, model: str) -> None:
+        """Load ``model`` and prime the system prompt prefix, pinning it with the keep-alive policy."""
+        messages = [{"role": "system", "content": self._system_prompt}] if self._system_prompt else []
+        messages.append({"role": "user", "content": "Reply with OK."})
+
+        kwargs = self.chat_kwargs(model)
+        kwargs["options"] = dict(kwargs["options"], num_predict=1)
+
+        started = time.perf_counter()
+        with tracing.span("ollama.warm", kind="client", model=model):
+            response = self._warm_client.chat(model=model, messages=messages, **kwargs)
+        self.record(model, response)
+        print(f"Ollama model '{model}' warmed in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def preload(self) -> None:
+        for model in self.models:
+            try:
+                with scheduler.slot(PREFETCH):
+                    self.warm(model)
+            except SchedulerOverloaded as err:
+                print(f"Warning: skipped warming '{model}': {err}")
+            except Exception as err:
+                print(f"Warning: could not warm Ollama model '{model}': {err}")
+
+    def preload_in_background(self) -> threading.Thread:
+        thread = threading.Thread(target=self.preload, name="ollama-preload", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            per_model = {}
+            for model, s in self._stats.items():
+                calls = s["cold_loads"] + s["warm_calls"]
+                per_model[model] = {
+                    "cold_loads": int(s["cold_loads"]),
+                    "cold_load_ms_avg": round(s["cold_load_ms_total"] / s["cold_loads"], 1) if s["cold_loads"] else None,
+                    "cold_load_ms_last": round(s["cold_load_ms_last"], 1),
+                    "warm_calls": int(s["warm_calls"]),
+                    "warm_load_ms_avg": round(s["warm_load_ms_total"] / s["warm_calls"], 1) if s["warm_calls"] else None,
+                    "prompt_tokens_avg": round(s["prompt_tokens_total"] / calls, 1) if calls else None,
+                    "prompt_eval_ms_avg": round(s["prompt_eval_ms_total"] / calls, 1) if calls else None,
+                }
+        return {"pinned_models": self.models, "keep_alive": self.keep_alive, "models": per_model}
+
+
+sessions = OllamaSessionManager(OLLAMA_MODELS, OLLAMA_KEEP_ALIVE, OLLAMA_ADHOC_KEEP_ALIVE, OLLAMA_NUM_CTX)
+
+metrics.register_collector(lambda: {"ollama": sessions.stats()})
@@ -0,0 +1,456 @@
+"""
+Local ingredient -> mood -> song index.
+
+A no-LLM fast path for playlist generation. Ingredients map to mood tags through a
+keyword table, songs are indexed by the same tags, and a playlist is ranked from the
+inverted index in microseconds. Output uses the same "N. Song – Artist" format that
+``spotify_playlist.parse_playlist`` consumes, so callers can't tell the difference.
+
+The built-in catalog is extended offline from past LLM playlists:
+
+    python playlist_index.py refresh
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from spotify_playlist import _parse_song_line
+
+
+INDEX_PATH = os.getenv("PLAYLIST_INDEX_PATH", os.path.join("data", "playlist_index.json"))
+HISTORY_PATH = os.getenv("PLAYLIST_HISTORY_PATH", os.path.join("data", "llm_playlists.jsonl"))
+
+DEFAULT_MOODS = ("warm", "mellow")
+
+# Keyword -> mood tags. Keywords match whole words or word prefixes of an ingredient
+# ("chilies", "chili flakes" and "chili" all match "chili").
+INGREDIENT_MOODS: Dict[str, Tuple[str, ...]] = {
+    "chili": ("spicy", "energetic", "bold"),
+    "chilli": ("spicy", "energetic", "bold"),
+    "jalapeno": ("spicy", "energetic", "playful"),
+    "cayenne": ("spicy", "bold"),
+    "habanero": ("spicy", "bold"),
+    "sriracha": ("spicy", "energetic"),
+    "curry": ("spicy", "warm", "bold"),
+    "masala": ("spicy", "warm"),
+    "gochujang": ("spicy", "savory"),
+    "pepper": ("spicy", "zesty"),
+    "garlic": ("savory", "bold"),
+    "onion": ("savory", "warm"),
+    "ginger": ("zesty", "bright"),
+    "lemon": ("zesty", "bright", "fresh"),
+    "lime": ("zesty", "bright", "fresh"),
+    "orange": ("zesty", "bright", "summery"),
+    "citrus": ("zesty", "bright", "fresh"),
+    "yuzu": ("zesty", "elegant"),
+    "tomato": ("warm", "summery"),
+    "basil": ("fresh", "summery"),
+    "oregano": ("warm", "earthy"),
+    "olive": ("mellow", "elegant"),
+    "parmesan": ("rich", "comforting"),
+    "mozzarella": ("rich", "comforting"),
+    "cheese": ("rich", "comforting", "indulgent"),
+    "cream": ("rich", "indulgent"),
+    "butter": ("rich", "comforting"),
+    "milk": ("comforting", "mellow"),
+    "chocolate": ("sweet", "romantic", "indulgent"),
+    "cocoa": ("sweet", "indulgent"),
+    "sugar": ("sweet", "playful"),
+    "honey": ("sweet", "warm", "romantic"),
+    "maple": ("sweet", "cozy"),
+    "caramel": ("sweet", "indulgent"),
+    "vanilla": ("sweet", "mellow"),
+    "strawberry": ("sweet", "playful", "summery"),
+    "berry": ("sweet", "playful", "summery"),
+    "berries": ("sweet", "playful", "summery"),
+    "mango": ("tropical", "summery", "sweet"),
+    "pineapple": ("tropical", "summery", "playful"),
+    "coconut": ("tropical", "mellow"),
+    "papaya": ("tropical", "summery"),
+    "banana": ("tropical", "cozy", "sweet"),
+    "potato": ("comforting", "cozy"),
+    "bread": ("comforting", "cozy"),
+    "rice": ("comforting", "mellow"),
+    "pasta": ("comforting", "warm"),
+    "noodle": ("comforting", "savory"),
+    "flour": ("comforting", "cozy"),
+    "dough": ("comforting", "cozy"),
+    "beef": ("bold", "savory", "smoky"),
+    "steak": ("bold", "smoky"),
+    "pork": ("savory", "smoky"),
+    "bacon": ("smoky", "indulgent"),
+    "lamb": ("bold", "earthy"),
+    "barbecue": ("smoky", "bold"),
+    "bbq": ("smoky", "bold"),
+    "smoked": ("smoky", "bold"),
+    "paprika": ("smoky", "warm"),
+    "chipotle": ("smoky", "spicy"),
+    "chicken": ("comforting", "mellow"),
+    "egg": ("comforting", "mellow"),
+    "fish": ("fresh", "elegant"),
+    "salmon": ("fresh", "elegant"),
+    "tuna": ("fresh", "mellow"),
+    "shrimp": ("fresh", "summery"),
+    "prawn": ("fresh", "summery"),
+    "crab": ("fresh", "elegant"),
+    "lobster": ("elegant", "indulgent"),
+    "seaweed": ("fresh", "mellow"),
+    "soy": ("savory", "mellow"),
+    "miso": ("savory", "mellow"),
+    "sesame": ("savory", "earthy"),
+    "mushroom": ("earthy", "elegant"),
+    "truffle": ("earthy", "elegant", "indulgent"),
+    "lettuce": ("fresh", "bright"),
+    "cucumber": ("fresh", "bright"),
+    "spinach": ("fresh", "earthy"),
+    "kale": ("fresh", "earthy"),
+    "avocado": ("fresh", "mellow", "summery"),
+    "mint": ("fresh", "bright"),
+    "cilantro": ("fresh", "zesty"),
+    "coriander": ("fresh", "zesty"),
+    "parsley": ("fresh", "bright"),
+    "cinnamon": ("cozy", "warm"),
+    "nutmeg": ("cozy", "warm"),
+    "clove": ("cozy", "warm"),
+    "pumpkin": ("cozy", "warm", "earthy"),
+    "apple": ("cozy", "sweet"),
+    "wine": ("elegant", "romantic"),
+    "coffee": ("energetic", "mellow"),
+    "espresso": ("energetic", "bold"),
+    "bean": ("earthy", "warm"),
+    "lentil": ("earthy", "warm"),
+    "chickpea": ("earthy", "warm"),
+    "corn": ("playful", "summery"),
+    "tortilla": ("playful", "warm"),
+    "salsa": ("spicy", "playful", "summery"),
+}
+
+# (song, artist, mood tags)
+SONG_CATALOG: List[Tuple[str, str, Tuple[str, ...]]] = [
+    ("Hot in Herre", "Nelly", ("spicy", "energetic", "playful")),
+    ("Ring of Fire", "Johnny Cash", ("spicy", "bold")),
+    ("Spice Up Your Life", "Spice Girls", ("spicy", "playful", "energetic")),
+    ("Burn", "Ellie Goulding", ("spicy", "energetic")),
+    ("Bamboleo", "Gipsy Kings", ("spicy", "energetic", "warm")),
+    ("Oye Como Va", "Santana", ("spicy", "warm", "bold")),
+    ("Vivir Mi Vida", "Marc Anthony", ("spicy", "energetic", "tropical")),
+    ("Jai Ho", "A. R. Rahman", ("spicy", "energetic")),
+    ("Mambo No. 5", "Lou Bega", ("spicy", "playful", "tropical")),
+    ("Bad Guy", "Billie Eilish", ("bold", "spicy")),
+    ("Uptown Funk", "Mark Ronson ft. Bruno Mars", ("energetic", "playful", "bold")),
+    ("Superstition", "Stevie Wonder", ("savory", "bold", "energetic")),
+    ("September", "Earth, Wind & Fire", ("energetic", "playful", "warm")),
+    ("Good as Hell", "Lizzo", ("energetic", "bold", "playful")),
+    ("Dynamite", "BTS", ("playful", "bright", "energetic")),
+    ("Sugar", "Maroon 5", ("sweet", "playful", "romantic")),
+    ("Pour Some Sugar on Me", "Def Leppard", ("sweet", "bold")),
+    ("Honey", "Kehlani", ("sweet", "romantic", "mellow")),
+    ("Watermelon Sugar", "Harry Styles", ("sweet", "summery", "playful")),
+    ("Strawberry Swing", "Coldplay", ("sweet", "mellow", "summery")),
+    ("Cake by the Ocean", "DNCE", ("sweet", "playful", "summery")),
+    ("Milkshake", "Kelis", ("sweet", "indulgent", "playful")),
+    ("Chocolate", "The 1975", ("sweet", "playful")),
+    ("Butter", "BTS", ("rich", "indulgent", "playful")),
+    ("Kokomo", "The Beach Boys", ("tropical", "summery", "mellow")),
+    ("Three Little Birds", "Bob Marley & The Wailers", ("tropical", "mellow", "warm")),
+    ("Despacito", "Luis Fonsi", ("tropical", "romantic", "playful")),
+    ("Island in the Sun", "Weezer", ("tropical", "summery", "bright")),
+    ("Coconut", "Harry Nilsson", ("tropical", "playful")),
+    ("Margaritaville", "Jimmy Buffett", ("tropical", "summery", "zesty")),
+    ("Chan Chan", "Buena Vista Social Club", ("warm", "tropical", "mellow")),
+    ("Banana Pancakes", "Jack Johnson", ("cozy", "comforting", "mellow")),
+    ("Better Together", "Jack Johnson", ("cozy", "romantic", "warm")),
+    ("Sunday Morning", "Maroon 5", ("cozy", "mellow", "comforting")),
+    ("Autumn Leaves", "Nat King Cole", ("cozy", "warm", "elegant")),
+    ("Harvest Moon", "Neil Young", ("earthy", "cozy", "mellow")),
+    ("Home", "Edward Sharpe & The Magnetic Zeros", ("comforting", "warm", "earthy")),
+    ("Thinking Out Loud", "Ed Sheeran", ("comforting", "romantic", "warm")),
+    ("Budapest", "George Ezra", ("warm", "comforting")),
+    ("Here Comes the Sun", "The Beatles", ("bright", "fresh", "warm")),
+    ("Walking on Sunshine", "Katrina and the Waves", ("bright", "energetic", "summery")),
+    ("Lovely Day", "Bill Withers", ("warm", "bright", "mellow")),
+    ("Put Your Records On", "Corinne Bailey Rae", ("bright", "fresh", "playful")),
+    ("Riptide", "Vance Joy", ("fresh", "bright", "playful")),
+    ("Ocean Eyes", "Billie Eilish", ("fresh", "mellow")),
+    ("Sea of Love", "Cat Power", ("fresh", "mellow", "romantic")),
+    ("Electric Feel", "MGMT", ("zesty", "energetic")),
+    ("Lemon", "N.E.R.D & Rihanna", ("zesty", "bold")),
+    ("Sour Candy", "Lady Gaga & BLACKPINK", ("zesty", "playful")),
+    ("Levitating", "Dua Lipa", ("zesty", "energetic", "bright")),
+    ("Smooth Operator", "Sade", ("elegant", "mellow", "romantic")),
+    ("Fly Me to the Moon", "Frank Sinatra", ("elegant", "romantic")),
+    ("La Vie en Rose", "Édith Piaf", ("elegant", "romantic")),
+    ("Feeling Good", "Nina Simone", ("rich", "bold", "elegant")),
+    ("At Last", "Etta James", ("romantic", "rich")),
+    ("Let's Stay Together", "Al Green", ("romantic", "warm", "mellow")),
+    ("Hallelujah", "Jeff Buckley", ("rich", "elegant", "mellow")),
+    ("Clair de Lune", "Claude Debussy", ("elegant", "mellow")),
+    ("Take Five", "The Dave Brubeck Quartet", ("elegant", "savory", "mellow")),
+    ("So What", "Miles Davis", ("savory", "mellow", "elegant")),
+    ("Plastic Love", "Mariya Takeuchi", ("mellow", "elegant")),
+    ("Sukiyaki", "Kyu Sakamoto", ("mellow", "savory")),
+    ("Champagne Supernova", "Oasis", ("indulgent", "rich")),
+    ("Rich Girl", "Hall & Oates", ("rich", "playful")),
+    ("Ain't No Sunshine", "Bill Withers", ("mellow", "earthy")),
+    ("Landslide", "Fleetwood Mac", ("earthy", "mellow")),
+    ("Dreams", "Fleetwood Mac", ("mellow", "earthy")),
+    ("Smoke on the Water", "Deep Purple", ("smoky", "bold")),
+    ("Back in Black", "AC/DC", ("bold", "energetic", "smoky")),
+    ("Seven Nation Army", "The White Stripes", ("bold", "smoky")),
+    ("Old Town Road", "Lil Nas X", ("smoky", "playful")),
+    ("Sweet Home Alabama", "Lynyrd Skynyrd", ("smoky", "warm", "savory")),
+    ("Everlong", "Foo Fighters", ("bold", "energetic")),
+]
+
+
+_KEYWORD_LENGTHS = sorted({len(keyword) for keyword in INGREDIENT_MOODS})
+
+# Every tag the index can rank by; the vision prompt offers these as mood_tags.
+MOOD_TAGS: Tuple[str, ...] = tuple(
+    sorted({tag for tags in INGREDIENT_MOODS.values() for tag in tags} | {tag for _, _, tags in SONG_CATALOG for tag in tags})
+)
+# Mood tags named by the vision model describe the whole dish, so they outweigh single-ingredient hints.
+EXPLICIT_MOOD_WEIGHT = 2.0
+
+
+def _split_ingredients(ingredients: str) -> List[str]:
+    return [part.strip().lower() for part in re.split(r"[,\n;]", ingredients or "") if part.strip()]
+
+
+def moods_for_ingredients(ingredients: str, extra_moods: Optional[Iterable[str]] = None) -> Counter:
+    """
+    Return mood tag -> weight for a comma-separated ingredient string.
+
+    ``extra_moods`` (e.g. the vision model's mood tags) are added with
+    ``EXPLICIT_MOOD_WEIGHT``; tags the index doesn't know are ignored.
+    """
+    moods: Counter = Counter()
+    for tag in extra_moods or ():
+        tag = tag.strip().lower()
+        if tag in MOOD_TAGS:
+            moods[tag] += EXPLICIT_MOOD_WEIGHT
+    for ingredient in _split_ingredients(ingredients):
+        matched = set()
+        for word in re.findall(r"[a-z]+", ingredient):
+            for length in _KEYWORD_LENGTHS:
+                if length > len(word):
+                    break
+                if word[:length] in INGREDIENT_MOODS:
+                    matched.add(word[:length])
+        for keyword in matched:
+            moods.update(INGREDIENT_MOODS[keyword])
+    if not moods:
+        moods.update(DEFAULT_MOODS)
+    return moods
+
+
+class PlaylistIndex:
+    """Song catalog indexed by mood tag, built from the seed catalog plus learned songs."""
+
+    def __init__(self, index_path: str = INDEX_PATH):
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._songs: List[Tuple[str, str, Dict[str, float]]] = []
+        self._by_tag: Dict[str, List[int]] = {}
+        self.reload()
+
+    def reload(self) -> None:
+        songs: Dict[Tuple[str, str], Dict[str, float]] = {}
+        for song, artist, tags in SONG_CATALOG:
+            songs[(song, artist)] = {tag: 1.0 for tag in tags}
+
+        for entry in _load_learned(self.index_path):
+            key = (entry["song"], entry["artist"])
+            tags = songs.setdefault(key, {})
+            for tag, weight in entry.get("tags", {}).items():
+                tags[tag] = max(tags.get(tag, 0.0), float(weight))
+
+        by_tag: Dict[str, List[int]] = defaultdict(list)
+        ordered = [(song, artist, tags) for (song, artist), tags in songs.items()]
+        for idx, (_, _, tags) in enumerate(ordered):
+            for tag in tags:
+                by_tag[tag].append(idx)
+
+        with self._lock:
+            self._songs = ordered
+            self._by_tag = dict(by_tag)
+
+    def __len__(self) -> int:
+        return len(self._songs)
+
+    def rank(
+        self,
+        moods: Dict[str, float],
+        size: int = 10,
+        avoid: Optional[Iterable[str]] = None,
+        seed: str = "",
+    ) -> List[Tuple[str, str]]:
+        """
+        Top ``size`` (song, artist) pairs for the given mood weights.
+
+        Songs sharing no mood tag fill the list when too few tagged ones are left,
+        and once ``avoid`` covers the whole catalog the earliest avoided songs come
+        back first, so the result is only short if the catalog itself is.
+        """
+        with self._lock:
+            songs, by_tag = self._songs, self._by_tag
+
+        avoided = [name.strip().lower() for name in (avoid or ())]
+        skip = set(avoided)
+        scores: Dict[int, float] = defaultdict(float)
+        for tag, weight in moods.items():
+            for idx in by_tag.get(tag, ()):
+                scores[idx] += weight * songs[idx][2][tag]
+
+        # Equal scores are ordered by a hash of the seed so different dishes (and
+        # re-rolls of the same dish) don't all get the same handful of songs.
+        ranked = sorted(
+            range(len(songs)),
+            key=lambda idx: (-scores.get(idx, 0.0), zlib.crc32(f"{seed}|{songs[idx][0]}".encode("utf-8"))),
+        )
+        picked = [idx for idx in ranked if songs[idx][0].lower() not in skip]
+        if len(picked) < size:
+            first_served = {}
+            for position, name in enumerate(avoided):
+                first_served.setdefault(name, position)
+            repeats = sorted(
+                (idx for idx in ranked if songs[idx][0].lower() in skip),
+                key=lambda idx: first_served[songs[idx][0].lower()],
+            )
+            picked += repeats[: size - len(picked)]
+        return [(songs[idx][0], songs[idx][1]) for idx in picked[:size]]
+
+
+def _load_learned(path: str) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            return json.load(handle).get("songs", [])
+    except (OSError, ValueError) as err:
+        print(f"Warning: could not load playlist index '{path}': {err}")
+        return []
+
+
+def format_playlist(songs: List[Tuple[str, str]]) -> str:
+    return "\n".join(f"{number}. {song} – {artist}" for number, (song, artist) in enumerate(songs, start=1))
+
+
+_index: Optional[PlaylistIndex] = None
+
+
+def get_index() -> PlaylistIndex:
+    global _index
+    if _index is None:
+        _index = PlaylistIndex()
+    return _index
+
+
+def build_playlist(
+    ingredients: str,
+    size: int = 10,
+    avoid: Optional[Iterable[str]] = None,
+    seed: Optional[str] = None,
+    moods: Optional[Iterable[str]] = None,
+) -> str:
+    """
+    Build a playlist for ``ingredients`` (and optional mood tags) from the local index, no LLM involved.
+
+    Returns "N. Song – Artist" lines, the same shape as the Mistral playlist text.
+    """
+    moods = moods_for_ingredients(ingredients, moods)
+    songs = get_index().rank(moods, size=size, avoid=avoid, seed=ingredients if seed is None else seed)
+    return format_playlist(songs)
+
+
+def record_llm_playlist(
+    ingredients: str,
+    playlist_text: str,
+    path: str = HISTORY_PATH,
+    moods: Optional[Iterable[str]] = None,
+) -> None:
+    """Append an LLM-generated playlist to the history log used by ``refresh_index``."""
+    entry = {"ts": time.time(), "ingredients": ingredients, "playlist": playlist_text}
+    if moods:
+        entry["moods"] = list(moods)
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf-8") as handle:
+            handle.write(json.dumps(entry) + "\n")
+    except OSError as err:
+        print(f"Warning: could not record playlist history: {err}")
+
+
+def refresh_index(history_path: str = HISTORY_PATH, index_path: str = INDEX_PATH) -> int:
+    """
+    Rebuild the learned song index from past LLM playlists.
+
+    Each song inherits the mood tags of the ingredients (and dish mood tags) it was
+    recommended for, weighted by how often it appeared with that mood. Returns the number of songs written.
+    """
+    tag_counts: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+    appearances: Counter = Counter()
+
+    if os.path.exists(history_path):
+        with open(history_path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                moods = moods_for_ingredients(entry.get("ingredients", ""), entry.get("moods"))
+                for raw in (entry.get("playlist") or "").splitlines():
+                    song, artist = _parse_song_line(raw)
+                    if not song:
+                        continue
+                    key = (song, artist)
+                    appearances[key] += 1
+                    tag_counts[key].update(moods)
+
+    songs = []
+    for key, counts in tag_counts.items():
+        total = sum(counts.values())
+        songs.append(
+            {
+                "song": key[0],
+                "artist": key[1],
+                "count": appearances[key],
+                # Normalise so learned songs compete with seed songs (weight 1.0) on equal footing.
+                "tags": {tag: round(count / total * len(counts), 3) for tag, count in counts.items()},
+            }
+        )
+
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump({"generated_at": time.time(), "songs": songs}, handle, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, index_path)
+
+    if _index is not None:
+        _index.reload()
+    return len(songs)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "build"
+
+    if command == "refresh":
+        count = refresh_index()
+        print(f"Wrote {count} learned songs to {INDEX_PATH}")
+    elif command == "build":
+        ingredients = " ".join(sys.argv[2:]) or "tomato, basil, garlic, olive oil, parmesan"
+        started = time.perf_counter()
+        playlist = build_playlist(ingredients)
+        elapsed_us = (time.perf_counter() - started) * 1e6
+        print(playlist)
+        print(f"\n({elapsed_us:.0f} µs)")
+    else:
+        print("Usage: python playlist_index.py [build <ingredients> | refresh]")
+        sys.exit(1)
@@ -0,0 +1,334 @@
+"""
+Latency-aware routing of playlist and history generation across text providers.
+
+Each provider/model pair keeps an exponentially weighted moving average of its
+latency and error rate. A request goes to the fastest healthy provider whose
+quality tier meets the requested minimum and fails over down the ranking when a
+call errors. Providers whose error rate crosses the threshold are skipped for a
+cooldown, after which they are tried again and either recover or cool down anew.
+
+A provider's latency is only measured when it serves a request, so the router
+explores: a small share of requests (``ROUTER_EXPLORE_RATE``), and any healthy
+provider not measured for ``ROUTER_EXPLORE_INTERVAL`` seconds, go to a provider
+other than the current fastest. Otherwise the seeded priors would decide routing
+for good.
+
+Tiers: 3 = GPT-4 class, 2 = Mistral small / local 3B-8B models, 0 = degraded
+(the local playlist index, used only when every real provider has failed).
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import metrics
+import tracing
+from food_history import REACT_PROMPT, FoodInfo, get_food_history
+from ingredients_playlist import (
+    PLAYLIST_LLM_TIMEOUT_MS,
+    PLAYLIST_MODE,
+    TEXT_MODEL,
+    _playlist_prompt,
+    client as mistral_client,
+    get_playlist_from_llm,
+    take_llm_budget,
+    text_policy,
+)
+from ollama_sessions import DEFAULT_HISTORY_MODEL
+from playlist_index import build_playlist, record_llm_playlist
+from resilience import CircuitOpenError, policy
+
+try:
+    from openai import OpenAI
+except ImportError:  # pragma: no cover - optional dependency
+    OpenAI = None
+
+
+PLAYLIST = "playlist"
+HISTORY = "history"
+LOCAL_PLAYLIST_PROVIDER = "local:playlist_index"
+
+PLAYLIST_MIN_TIER = int(os.getenv("PLAYLIST_MIN_TIER", "1"))
+HISTORY_MIN_TIER = int(os.getenv("HISTORY_MIN_TIER", "1"))
+OPENAI_TEXT_MODEL = os.getenv("OPENAI_TEXT_MODEL", "gpt-4o")
+HISTORY_LLM_TIMEOUT_MS = int(os.getenv("HISTORY_LLM_TIMEOUT_MS", "45000"))
+OPENAI_TIMEOUT_MS = int(os.getenv("OPENAI_TIMEOUT_MS", "45000"))
+
+# Long JSON answers: own timeout and p95, but the same breaker as other Mistral text calls.
+history_policy = policy(
+    "mistral-text-history",
+    timeout=HISTORY_LLM_TIMEOUT_MS / 1000,
+    hedge=text_policy.hedge,
+    breaker=text_policy.breaker,
+)
+# Failover is the router's job, so the SDK's own retries are off and each call is bounded.
+openai_policy = policy("openai-text", timeout=OPENAI_TIMEOUT_MS / 1000)
+
+EWMA_ALPHA = 0.2
+ERROR_RATE_THRESHOLD = 0.5
+COOLDOWN_SECONDS = 30.0
+ROUTER_EXPLORE_RATE = float(os.getenv("ROUTER_EXPLORE_RATE", "0.05"))
+ROUTER_EXPLORE_INTERVAL = float(os.getenv("ROUTER_EXPLORE_INTERVAL", "300"))
+
+HISTORY_JSON_INSTRUCTIONS = (
+    "\nRespond only with a JSON object with the string keys "
+    '"food_history", "modern_culture" and "fun_facts".'
+)
+
+
+class ProviderUnavailable(Exception):
+    """Raised when a provider declines a call without trying, e.g. its budget is spent."""
+
+
+class Provider:
+    def __init__(self, name: str, task: str, tier: int, call: Callable, prior_latency: float):
+        self.name = name
+        self.task = task
+        self.tier = tier
+        self.call = call
+        self.latency = prior_latency  # EWMA seconds, seeded with a typical value
+        self.error_rate = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.cooldown_until = 0.0
+        # Counts as measured at registration so startup doesn't probe every provider at once.
+        self.last_tried = time.monotonic()
+
+    def healthy(self, now: float) -> bool:
+        return self.error_rate < ERROR_RATE_THRESHOLD or now >= self.cooldown_until
+
+    def observe(self, latency: Optional[float], failed: bool) -> None:
+        self.calls += 1
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate + EWMA_ALPHA * (1.0 if failed else 0.0)
+        if failed:
+            self.errors += 1
+            if self.error_rate >= ERROR_RATE_THRESHOLD:
+                self.cooldown_until = time.monotonic() + COOLDOWN_SECONDS
+        elif latency is not None:
+            self.latency = (1 - EWMA_ALPHA) * self.latency + EWMA_ALPHA * latency
+
+
+class ProviderRouter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._providers: List[Provider] = []
+
+    def register(self, provider: Provider) -> None:
+        with self._lock:
+            self._providers.append(provider)
+
+    def ranked(self, task: str, min_tier: int, degraded: bool = True) -> List[Provider]:
+        """Providers for ``task`` in the order they will be tried; ``degraded=False`` leaves out below-tier ones."""
+        now = time.monotonic()
+        with self._lock:
+            eligible = [p for p in self._providers if p.task == task and p.tier >= min_tier]
+            below_tier = [p for p in self._providers if p.task == task and p.tier < min_tier] if degraded else []
+        healthy = sorted((p for p in eligible if p.healthy(now)), key=lambda p: p.latency)
+        cooling = sorted((p for p in eligible if not p.healthy(now)), key=lambda p: p.latency)
+        probe = self._explore(healthy[1:], now)
+        if probe is not None:
+            healthy.remove(probe)
+            healthy.insert(0, probe)
+            metrics.incr("router_explorations_total", task=task, provider=probe.name)
+        # Below-tier providers (the local index) answer while the tier's providers
+        # cool down; cooling providers are only tried when nothing else is left.
+        return healthy + sorted(below_tier, key=lambda p: -p.tier) + cooling
+
+    def _explore(self, candidates: List[Provider], now: float) -> Optional[Provider]:
+        """Pick a runner-up to try first: the longest-unmeasured stale one, else one at random now and then."""
+        with self._lock:
+            stale = [p for p in candidates if now - p.last_tried >= ROUTER_EXPLORE_INTERVAL]
+            if stale:
+                probe = min(stale, key=lambda p: p.last_tried)
+            elif candidates and random.random() < ROUTER_EXPLORE_RATE:
+                probe = random.choice(candidates)
+            else:
+                return None
+            # Claim it now so concurrent requests don't all probe the same provider.
+            probe.last_tried = now
+            return probe
+
+    def call(self, task: str, min_tier: int, *args, degraded: bool = True, **kwargs) -> Tuple[object, str]:
+        """Run ``task`` on the best provider, failing over in rank order. Returns (result, provider name)."""
+        last_error: Optional[Exception] = None
+        failed_attempts = 0  # providers that were called and errored; skips don't count
+        with tracing.span(f"router.{task}", min_tier=min_tier) as sp:
+            for attempt, provider in enumerate(self.ranked(task, min_tier, degraded)):
+                with self._lock:
+                    provider.last_tried = time.monotonic()
+                started = time.perf_counter()
+                try:
+                    with tracing.retrying(failed_attempts):
+                        result = provider.call(*args, **kwargs)
+                except (ProviderUnavailable, CircuitOpenError) as err:
+                    # Declined without calling upstream, so it says nothing about latency or health.
+                    last_error = err
+                    metrics.incr("router_skipped_total", task=task, provider=provider.name)
+                    continue
+                except Exception as err:
+                    last_error = err
+                    failed_attempts += 1
+                    with self._lock:
+                        provider.observe(None, failed=True)
+                    metrics.incr("router_failures_total", task=task, provider=provider.name)
+                    print(f"Warning: {task} provider '{provider.name}' failed: {err}")
+                    continue
+
+                with self._lock:
+                    provider.observe(time.perf_counter() - started, failed=False)
+                metrics.incr("router_decisions_total", task=task, provider=provider.name)
+                if attempt:
+                    metrics.incr("router_failovers_total", task=task)
+                sp.set_attributes(**{"router.provider": provider.name, "router.failovers": attempt, "router.tier": provider.tier})
+                return result, provider.name
+
+        raise RuntimeError(f"All {task} providers failed: {last_error}")
+
+    def stats(self) -> Dict[str, object]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                f"{p.task}:{p.name}": {
+                    "tier": p.tier,
+                    "latency_ms_ewma": round(p.latency * 1000, 1),
+                    "error_rate_ewma": round(p.error_rate, 3),
+                    "calls": p.calls,
+                    "errors": p.errors,
+                    "healthy": p.healthy(now),
+                }
+                for p in self._providers
+            }
+
+
+# ----------------------------------------------------------------------
+# Provider adapters
+# ----------------------------------------------------------------------
+def _mistral_playlist(ingredients: str, avoid: Optional[List[str]] = None, moods: Optional[List[str]] = None) -> str:
+    # The hourly budget only exists to push "auto" traffic onto the local index.
+    if PLAYLIST_MODE == "auto" and not take_llm_budget():
+        raise ProviderUnavailable("playlist LLM budget spent")
+    return get_playlist_from_llm(ingredients, timeout_ms=PLAYLIST_LLM_TIMEOUT_MS, avoid=avoid, moods=moods)
+
+
+def _local_playlist(ingredients: str, avoid: Optional[List[str]] = None, moods: Optional[List[str]] = None) -> str:
+    # Vary the tie-break on re-rolls so the index doesn't just serve the next songs in order.
+    return build_playlist(ingredients, avoid=avoid, seed=f"{ingredients}|{len(avoid or ())}", moods=moods)
+
+
+def _mistral_history(food_name: str) -> Dict[str, str]:
+    messages = [
+        {"role": "system", "content": REACT_PROMPT + HISTORY_JSON_INSTRUCTIONS},
+        {"role": "user", "content": f"Apply ReAct methodology to provide comprehensive information about: {food_name}"},
+    ]
+
+    def attempt(timeout: float) -> str:
+        with tracing.span("mistral.chat", kind="client", model=TEXT_MODEL, payload_bytes=sum(len(m["content"]) for m in messages)) as sp:
+            resp = mistral_client.chat.complete(
+                model=TEXT_MODEL,
+                messages=messages,
+                response_format={"type": "json_object"},
+                timeout_ms=int(timeout * 1000),
+            )
+            tracing.record_usage(sp, resp.usage)
+        return resp.choices[0].message.content
+
+    content = history_policy.call(attempt)
+    return FoodInfo.model_validate_json(content).model_dump()
+
+
+def _openai_chat(messages: List[Dict[str, str]], json_mode: bool = False) -> str:
+    kwargs = {"response_format": {"type": "json_object"}} if json_mode else {}
+
+    def attempt(timeout: float) -> str:
+        with tracing.span("openai.chat", kind="client", model=OPENAI_TEXT_MODEL, payload_bytes=sum(len(m["content"]) for m in messages)) as sp:
+            resp = _openai_client.chat.completions.create(
+                model=OPENAI_TEXT_MODEL,
+                messages=messages,
+                temperature=0.6,
+                timeout=timeout,
+                **kwargs,
+            )
+            tracing.record_usage(sp, resp.usage)
+        return resp.choices[0].message.content
+
+    return openai_policy.call(attempt)
+
+
+def _openai_playlist(ingredients: str, avoid: Optional[List[str]] = None, moods: Optional[List[str]] = None) -> str:
+    playlist = _openai_chat([{"role": "user", "content": _playlist_prompt(ingredients, avoid, moods)}])
+    # Logged like Mistral's playlists so `playlist_index.py refresh` learns from them too.
+    record_llm_playlist(ingredients, playlist, moods=moods)
+    return playlist
+
+
+def _openai_history(food_name: str) -> Dict[str, str]:
+    content = _openai_chat(
+        [
+            {"role": "system", "content": REACT_PROMPT + HISTORY_JSON_INSTRUCTIONS},
+            {"role": "user", "content": f"Apply ReAct methodology to provide comprehensive information about: {food_name}"},
+        ],
+        json_mode=True,
+    )
+    return FoodInfo.model_validate_json(content).model_dump()
+
+
+router = ProviderRouter()
+
+router.register(Provider(f"mistral:{TEXT_MODEL}", PLAYLIST, 2, _mistral_playlist, prior_latency=3.0))
+router.register(Provider(LOCAL_PLAYLIST_PROVIDER, PLAYLIST, 0, _local_playlist, prior_latency=0.001))
+router.register(
+    Provider(
+        f"ollama:{DEFAULT_HISTORY_MODEL}",
+        HISTORY,
+        2,
+        lambda food_name: get_food_history(food_name, model=DEFAULT_HISTORY_MODEL),
+        # The pinned local model is preferred until measurements say otherwise.
+        prior_latency=4.0,
+    )
+)
+router.register(Provider(f"mistral:{TEXT_MODEL}", HISTORY, 2, _mistral_history, prior_latency=6.0))
+
+_openai_client = OpenAI(max_retries=0) if OpenAI is not None and os.getenv("OPENAI_API_KEY") else None
+if _openai_client is not None:
+    router.register(Provider(f"openai:{OPENAI_TEXT_MODEL}", PLAYLIST, 3, _openai_playlist, prior_latency=6.0))
+    router.register(Provider(f"openai:{OPENAI_TEXT_MODEL}", HISTORY, 3, _openai_history, prior_latency=10.0))
+
+metrics.register_collector(lambda: {"providers": router.stats()})
+
+
+def generate_playlist(
+    ingredients: str,
+    avoid: Optional[List[str]] = None,
+    min_tier: int = PLAYLIST_MIN_TIER,
+    moods: Optional[List[str]] = None,
+) -> Tuple[str, str]:
+    """
+    Playlist text from the fastest healthy provider. Returns (playlist, provider name).
+
+    ``avoid`` lists song titles already served for this dish, so re-rolls come back different.
+    ``moods`` are the dish's mood tags from the vision step. ``PLAYLIST_MODE=local``
+    skips the LLMs entirely and ``PLAYLIST_MODE=llm`` never falls back to the index.
+    """
+    span = tracing.current_span()
+    if PLAYLIST_MODE == "local":
+        metrics.incr("playlist_source_total", source="local", reason="mode")
+        span.set_attributes(**{"playlist.source": "local", "playlist.fallback_reason": "mode"})
+        return _local_playlist(ingredients, avoid, moods), LOCAL_PLAYLIST_PROVIDER
+
+    playlist, provider = router.call(
+        PLAYLIST, min_tier, ingredients, degraded=PLAYLIST_MODE != "llm", avoid=avoid, moods=moods
+    )
+    if provider == LOCAL_PLAYLIST_PROVIDER:
+        metrics.incr("playlist_source_total", source="local", reason="fallback")
+        span.set_attributes(**{"playlist.source": "local", "playlist.fallback_reason": "fallback"})
+    else:
+        metrics.incr("playlist_source_total", source="llm")
+        span.set_attribute("playlist.source", "llm")
+    return playlist, provider
+
+
+def generate_history(food_name: str, min_tier: int = HISTORY_MIN_TIER) -> Tuple[Dict[str, str], str]:
+    """Food history dict from the fastest healthy provider. Returns (history, provider name)."""
+    return router.call(HISTORY, min_tier, food_name)
@@ -0,0 +1,273 @@
+"""
+Failure isolation for upstream model calls: per-call timeouts, circuit breakers
+and optional hedged requests.
+
+A ``ResiliencePolicy`` wraps one upstream (e.g. Mistral vision). Every attempt
+gets a timeout, consecutive failures open the breaker so callers fail fast with
+``CircuitOpenError`` instead of piling onto a degraded service, and after
+``reset_timeout`` one trial call is let through to probe recovery. With hedging
+enabled, a second identical call is sent when the first hasn't answered within
+the recent p95 latency and whichever finishes first wins. Hedges are capped to
+``HEDGE_BUDGET_RATIO`` of recent calls and paused while the breaker has seen a
+failure within ``reset_timeout``, so a slowing service isn't sent extra load.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Dict, Optional
+
+import httpx
+
+import metrics
+import tracing
+
+try:
+    from openai import APIConnectionError as _OpenAIConnectionError
+except ImportError:  # pragma: no cover - optional dependency
+    _OpenAIConnectionError = None
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Hedging needs a meaningful p95 before it kicks in.
+MIN_SAMPLES_FOR_HEDGE = 20
+MIN_HEDGE_DELAY = 0.05
+# Every call earns this fraction of a hedge; at most HEDGE_BUDGET_BURST can be saved up.
+HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", "0.1"))
+HEDGE_BUDGET_BURST = float(os.getenv("HEDGE_BUDGET_BURST", "5"))
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("HEDGE_MAX_WORKERS", "16")), thread_name_prefix="hedge")
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while a circuit breaker is open."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} circuit open, retry in {retry_in:.1f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+def is_upstream_failure(err: BaseException) -> bool:
+    """
+    True for errors that say the upstream is unhealthy: timeouts, connection
+    errors, 429 and 5xx. Other HTTP statuses (a bad upload, a 401) are the
+    caller's problem and must not open the breaker for everyone.
+    """
+    status = getattr(err, "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    transport = (TimeoutError, ConnectionError, httpx.TransportError)
+    if _OpenAIConnectionError is not None:
+        transport += (_OpenAIConnectionError,)
+    return isinstance(err, transport)
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._last_failure_at = float("-inf")
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def failed_recently(self) -> bool:
+        """True if any call failed within the last ``reset_timeout`` seconds."""
+        with self._lock:
+            return time.monotonic() - self._last_failure_at < self.reset_timeout
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call may go upstream right now."""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            elapsed = time.monotonic() - self._opened_at
+            if self._state == OPEN and elapsed >= self.reset_timeout:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            retry_in = max(0.0, self.reset_timeout - elapsed)
+        metrics.incr("circuit_rejected_total", breaker=self.name)
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != CLOSED:
+                print(f"Circuit '{self.name}' closed")
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_ignored(self) -> None:
+        """Finish a call whose error says nothing about upstream health."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._last_failure_at = time.monotonic()
+            self._trial_in_flight = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    print(f"Warning: circuit '{self.name}' opened after {self._failures} failures")
+                    metrics.incr("circuit_opened_total", breaker=self.name)
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Sliding window of recent successful call latencies."""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < MIN_SAMPLES_FOR_HEDGE:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def _as_hedge(fn: Callable[[float], object], timeout: float) -> object:
+    # The duplicate is one attempt later than the call it hedges.
+    with tracing.retrying(tracing.retry_count() + 1):
+        return fn(timeout)
+
+
+class ResiliencePolicy:
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        hedge: bool = False,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.hedge = hedge
+        # Policies for different call shapes against one service can share a breaker.
+        self.breaker = breaker or CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.latency = LatencyTracker()
+        self._budget_lock = threading.Lock()
+        self._hedge_tokens = HEDGE_BUDGET_BURST
+
+    def _earn_hedge(self) -> None:
+        with self._budget_lock:
+            self._hedge_tokens = min(HEDGE_BUDGET_BURST, self._hedge_tokens + HEDGE_BUDGET_RATIO)
+
+    def _take_hedge(self) -> bool:
+        with self._budget_lock:
+            if self._hedge_tokens < 1:
+                return False
+            self._hedge_tokens -= 1
+            return True
+
+    def hedge_delay(self) -> Optional[float]:
+        p95 = self.latency.percentile(0.95)
+        return None if p95 is None else max(MIN_HEDGE_DELAY, p95)
+
+    def call(self, fn: Callable[[float], object], timeout: Optional[float] = None) -> object:
+        """
+        Run ``fn(timeout_seconds)`` under this policy.
+
+        ``fn`` must enforce the timeout it is given on its own upstream request
+        (e.g. the Mistral SDK's ``timeout_ms``); it may be invoked twice when hedging.
+        ``timeout`` overrides the policy default for calls that are slower by nature.
+        """
+        self.breaker.before_call()
+        timeout = timeout or self.timeout
+        started = time.perf_counter()
+        span = tracing.current_span()
+        self._earn_hedge()
+        try:
+            delay = self.hedge_delay() if self.hedge and not self.breaker.failed_recently() else None
+            if delay is None:
+                result = fn(timeout)
+            else:
+                result = self._hedged(fn, timeout, delay, span)
+        except Exception as err:
+            if not is_upstream_failure(err):
+                self.breaker.record_ignored()
+                metrics.incr("upstream_rejected_total", upstream=self.name)
+                raise
+            self.breaker.record_failure()
+            metrics.incr("upstream_failures_total", upstream=self.name)
+            raise
+
+        self.breaker.record_success()
+        self.latency.add(time.perf_counter() - started)
+        return result
+
+    def _hedged(self, fn: Callable[[float], object], timeout: float, delay: float, span) -> object:
+        # Each attempt runs in a copy of the caller's context so its spans join the request's trace.
+        primary = _executor.submit(contextvars.copy_context().run, fn, timeout)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        if not self._take_hedge():
+            metrics.incr("hedges_skipped_total", upstream=self.name, reason="budget")
+            return primary.result()
+
+        metrics.incr("hedged_requests_total", upstream=self.name)
+        span.set_attributes(hedged=True, hedge_delay_ms=round(delay * 1000, 1))
+        hedge = _executor.submit(contextvars.copy_context().run, _as_hedge, fn, timeout)
+
+        pending = {primary, hedge}
+        last_error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        metrics.incr("hedge_wins_total", upstream=self.name)
+                    return future.result()
+                last_error = future.exception()
+        raise last_error
+
+    def stats(self) -> Dict[str, object]:
+        p95 = self.latency.percentile(0.95)
+        return {
+            "state": self.breaker.state,
+            "timeout_s": self.timeout,
+            "hedge": self.hedge,
+            "hedge_tokens": round(self._hedge_tokens, 2),
+            "p95_ms": None if p95 is None else round(p95 * 1000, 1),
+        }
+
+
+_policies: Dict[str, ResiliencePolicy] = {}
+
+
+def policy(name: str, timeout: float, hedge: bool = False, **breaker_options) -> ResiliencePolicy:
+    """Create (or return the existing) named policy; all policies are reported in /api/metrics."""
+    if name not in _policies:
+        _policies[name] = ResiliencePolicy(name, timeout, hedge, **breaker_options)
+    return _policies[name]
+
+
+metrics.register_collector(lambda: {"resilience": {name: p.stats() for name, p in _policies.items()}})
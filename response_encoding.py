@@ -0,0 +1,157 @@
+import gzip
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+from flask import Response, request
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    from msgspec import msgpack as _msgpack
+
+    def _msgpack_encode(payload: Any) -> bytes:
+        return _msgpack.encode(payload)
+except ImportError:  # pragma: no cover - optional dependency
+    try:
+        import msgpack as _msgpack
+
+        def _msgpack_encode(payload: Any) -> bytes:
+            return _msgpack.packb(payload, use_bin_type=True)
+    except ImportError:
+        _msgpack_encode = None
+
+
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPES = ["application/msgpack", "application/x-msgpack", "application/vnd.msgpack"]
+
+# Below this size compression overhead outweighs the savings.
+MIN_COMPRESS_BYTES = 512
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Keys that survive any projection so clients can always tell success from failure.
+ALWAYS_INCLUDED = {"success", "error"}
+
+
+def _parse_fields(fields: str) -> Dict[str, Dict]:
+    """Turn "a,b.c,-d.e" into include/exclude trees keyed by path segment."""
+    include: Dict[str, Dict] = {}
+    exclude: Dict[str, Dict] = {}
+    for raw in fields.split(","):
+        path = raw.strip()
+        if not path:
+            continue
+        target = include
+        if path.startswith("-"):
+            target, path = exclude, path[1:]
+        node = target
+        for part in path.split("."):
+            node = node.setdefault(part, {})
+    return {"include": include, "exclude": exclude}
+
+
+def _apply(value: Any, include: Optional[Dict], exclude: Optional[Dict], top_level: bool = False) -> Any:
+    # Projections apply element-wise through lists, e.g. parsed_playlist.song.
+    if isinstance(value, list):
+        return [_apply(item, include, exclude, top_level) for item in value]
+    if not isinstance(value, dict):
+        return value
+
+    result = {}
+    for key, item in value.items():
+        sub_include = None
+        if include:
+            if key in include:
+                sub_include = include[key] or None
+            elif not (top_level and key in ALWAYS_INCLUDED):
+                continue
+
+        sub_exclude = (exclude or {}).get(key)
+        if sub_exclude == {}:
+            continue
+
+        result[key] = _apply(item, sub_include, sub_exclude)
+    return result
+
+
+def project(payload: Dict[str, Any], fields: Optional[str]) -> Dict[str, Any]:
+    """
+    Apply a ``fields=`` projection to a response payload.
+
+    Plain paths select what to keep and ``-`` prefixed paths drop keys, both using
+    dots to reach into nested objects and lists, e.g.
+    ``fields=food_name,parsed_playlist.song,parsed_playlist.artist`` or
+    ``fields=-playlist,-parsed_playlist.spotify_url,-parsed_playlist.youtube_url``.
+    """
+    if not fields:
+        return payload
+    spec = _parse_fields(fields)
+    return _apply(payload, spec["include"] or None, spec["exclude"] or None, top_level=True)
+
+
+def _choose_encoding() -> Optional[str]:
+    offered: List[str] = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best = request.accept_encodings.best_match(offered)
+    return best if best in offered else None
+
+
+def _choose_mimetype() -> str:
+    if _msgpack_encode is None:
+        return JSON_MIMETYPE
+    return request.accept_mimetypes.best_match([JSON_MIMETYPE] + MSGPACK_MIMETYPES, default=JSON_MIMETYPE)
+
+
+def representation_tag() -> str:
+    """
+    Short token naming the representation ``compact_response`` will produce for
+    this request, e.g. "json", "msgpack.br" or "json.gzip.f3a1c2d0".
+
+    Strong ETags must differ per representation, so cacheable routes combine this
+    with a digest of their content.
+    """
+    mimetype = _choose_mimetype()
+    parts = ["msgpack" if mimetype in MSGPACK_MIMETYPES else "json"]
+    encoding = _choose_encoding()
+    if encoding:
+        parts.append(encoding)
+    fields = request.args.get("fields")
+    if fields:
+        parts.append(hashlib.sha1(fields.encode("utf-8")).hexdigest()[:8])
+    return ".".join(parts)
+
+
+def compact_response(payload: Dict[str, Any], status: int = 200) -> Response:
+    """
+    Build a response for ``payload`` negotiated from the current request.
+
+    Honours ``?fields=`` projection, ``Accept: application/msgpack`` and gzip/brotli
+    via ``Accept-Encoding``. Clients that send none of these get plain compact JSON.
+    """
+    payload = project(payload, request.args.get("fields"))
+
+    mimetype = _choose_mimetype()
+    if mimetype in MSGPACK_MIMETYPES:
+        body = _msgpack_encode(payload)
+    else:
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    response = Response(status=status, mimetype=mimetype)
+    response.vary.update(["Accept", "Accept-Encoding"])
+
+    encoding = _choose_encoding() if len(body) >= MIN_COMPRESS_BYTES else None
+    if encoding == "br":
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+    elif encoding == "gzip":
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+
+    response.set_data(body)
+    metrics.incr("response_bytes_total", len(body), encoding=encoding or "identity", mimetype=mimetype)
+    return response
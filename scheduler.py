@@ -0,0 +1,212 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional
+
+import metrics
+import tracing
+
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PREFETCH = "prefetch"
+
+# Highest priority first; shedding walks this list from the end.
+LANES = (INTERACTIVE, BULK, PREFETCH)
+
+DEFAULT_WEIGHTS = {INTERACTIVE: 8, BULK: 2, PREFETCH: 1}
+DEFAULT_MAX_QUEUE = {INTERACTIVE: 64, BULK: 32, PREFETCH: 8}
+
+
+class SchedulerOverloaded(Exception):
+    """Raised when a request is rejected or shed; carries a Retry-After hint in seconds."""
+
+    def __init__(self, lane: str, retry_after: int, reason: str = "queue full"):
+        super().__init__(f"{lane} lane overloaded ({reason}), retry after {retry_after}s")
+        self.lane = lane
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Ticket:
+    __slots__ = ("lane", "granted", "shed")
+
+    def __init__(self, lane: str):
+        self.lane = lane
+        self.granted = False
+        self.shed = False
+
+
+class PriorityScheduler:
+    """
+    Admission control and weighted fair sharing in front of the model-calling stages.
+
+    At most ``capacity`` upstream calls run at once. Waiting requests are queued per
+    lane and granted slots by stride scheduling, so with weights 8/2/1 interactive
+    traffic gets 4x the share of bulk (8/2) when both are backlogged, but bulk is never
+    starved. Once the total queue reaches ``shed_threshold`` new bulk/prefetch work
+    is rejected and queued low-priority waiters are evicted to make room for
+    interactive requests.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 4,
+        weights: Optional[Dict[str, int]] = None,
+        max_queue: Optional[Dict[str, int]] = None,
+        shed_threshold: int = 48,
+        max_wait: float = 30.0,
+    ):
+        self.capacity = max(1, capacity)
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.max_queue = dict(DEFAULT_MAX_QUEUE, **(max_queue or {}))
+        self.shed_threshold = shed_threshold
+        self.max_wait = max_wait
+
+        self._cond = threading.Condition()
+        self._queues: Dict[str, Deque[_Ticket]] = {lane: deque() for lane in LANES}
+        self._pass: Dict[str, float] = {lane: 0.0 for lane in LANES}
+        self._active = 0
+        self._avg_service = 1.0  # EWMA of seconds per slot, seeds the Retry-After estimate
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    @contextmanager
+    def slot(self, lane: str = INTERACTIVE, timeout: Optional[float] = None) -> Iterator[None]:
+        """Hold one unit of upstream capacity for the duration of the block."""
+        with tracing.span("scheduler.wait", lane=lane):
+            self.acquire(lane, timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def acquire(self, lane: str = INTERACTIVE, timeout: Optional[float] = None) -> None:
+        if lane not in self._queues:
+            raise ValueError(f"Unknown lane '{lane}'. Use one of: {', '.join(LANES)}")
+
+        deadline = time.monotonic() + (self.max_wait if timeout is None else timeout)
+        with self._cond:
+            self._admit(lane)
+            ticket = _Ticket(lane)
+            self._queues[lane].append(ticket)
+            self._dispatch()
+
+            while not ticket.granted and not ticket.shed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queues[lane].remove(ticket)
+                    metrics.incr("scheduler_timeouts_total", lane=lane)
+                    raise SchedulerOverloaded(lane, self.retry_after(), "timed out waiting for capacity")
+                self._cond.wait(remaining)
+
+            if ticket.shed:
+                metrics.incr("scheduler_shed_total", lane=lane)
+                raise SchedulerOverloaded(lane, self.retry_after(), "shed for higher-priority work")
+
+        metrics.incr("scheduler_granted_total", lane=lane)
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        with self._cond:
+            self._active -= 1
+            if service_time is not None:
+                self._avg_service = 0.8 * self._avg_service + 0.2 * service_time
+            self._dispatch()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def overloaded(self) -> bool:
+        """True when the load balancer should back off from this instance."""
+        return self.queue_depth() >= self.shed_threshold
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog is expected to drain, at least 1."""
+        queued = sum(len(q) for q in self._queues.values())
+        return max(1, math.ceil(queued / self.capacity * self._avg_service))
+
+    def stats(self) -> Dict[str, object]:
+        with self._cond:
+            return {
+                "capacity": self.capacity,
+                "active": self._active,
+                "queued": {lane: len(q) for lane, q in self._queues.items()},
+                "avg_service_seconds": round(self._avg_service, 3),
+                "retry_after": self.retry_after(),
+            }
+
+    # ------------------------------------------------------------------
+    # Internals (caller holds self._cond)
+    # ------------------------------------------------------------------
+    def _admit(self, lane: str) -> None:
+        total = sum(len(q) for q in self._queues.values())
+
+        if len(self._queues[lane]) >= self.max_queue[lane]:
+            metrics.incr("scheduler_rejected_total", lane=lane)
+            raise SchedulerOverloaded(lane, self.retry_after())
+
+        if total < self.shed_threshold:
+            return
+
+        if lane != INTERACTIVE:
+            metrics.incr("scheduler_rejected_total", lane=lane)
+            raise SchedulerOverloaded(lane, self.retry_after(), "shedding low-priority traffic")
+
+        # Interactive request over the threshold: evict the newest low-priority waiter.
+        for victim_lane in reversed(LANES[1:]):
+            if self._queues[victim_lane]:
+                victim = self._queues[victim_lane].pop()
+                victim.shed = True
+                self._cond.notify_all()
+                return
+
+    def _dispatch(self) -> None:
+        granted = False
+        while self._active < self.capacity:
+            waiting = [lane for lane in LANES if self._queues[lane]]
+            if not waiting:
+                break
+            lane = min(waiting, key=lambda name: (self._pass[name], LANES.index(name)))
+            ticket = self._queues[lane].popleft()
+            ticket.granted = True
+            self._active += 1
+            self._pass[lane] += 1.0 / self.weights[lane]
+            granted = True
+
+        # A lane that was idle must not bank credit and then starve the others.
+        floor = min(self._pass[lane] for lane in LANES if self._queues[lane]) if any(self._queues.values()) else None
+        if floor is not None:
+            for lane in LANES:
+                if not self._queues[lane] and self._pass[lane] < floor:
+                    self._pass[lane] = floor
+
+        if granted:
+            self._cond.notify_all()
+
+
+def lane_from_request(value: Optional[str]) -> str:
+    """Map an X-Request-Priority header / ?priority= value to a lane, defaulting to interactive."""
+    lane = (value or INTERACTIVE).strip().lower()
+    if lane not in LANES:
+        raise ValueError(f"Invalid priority '{value}'. Use one of: {', '.join(LANES)}")
+    return lane
+
+
+scheduler = PriorityScheduler(
+    capacity=int(os.getenv("SCHEDULER_CAPACITY", "4")),
+    weights={
+        INTERACTIVE: int(os.getenv("SCHEDULER_WEIGHT_INTERACTIVE", DEFAULT_WEIGHTS[INTERACTIVE])),
+        BULK: int(os.getenv("SCHEDULER_WEIGHT_BULK", DEFAULT_WEIGHTS[BULK])),
+        PREFETCH: int(os.getenv("SCHEDULER_WEIGHT_PREFETCH", DEFAULT_WEIGHTS[PREFETCH])),
+    },
+    shed_threshold=int(os.getenv("SCHEDULER_SHED_THRESHOLD", "48")),
+    max_wait=float(os.getenv("SCHEDULER_MAX_WAIT", "30")),
+)
+
+metrics.register_collector(lambda: {"scheduler": scheduler.stats()})
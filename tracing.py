@@ -0,0 +1,343 @@
+"""
+Lightweight per-request tracing.
+
+Spans are collected per request and written, one trace per line, to a rotating
+local file in the OTLP/JSON shape the OpenTelemetry Collector's file exporter
+uses, so the output can be replayed into any OTLP-compatible backend.
+
+Traces are head-sampled at ``TRACE_SAMPLE_RATE``; traces whose root span takes
+longer than ``TRACE_SLOW_MS`` are always kept so slow requests are never lost.
+
+Summarise the slowest traces and their critical path with:
+
+    python tracing.py summarize [--file traces/traces.jsonl] [--top 10]
+"""
+
+import argparse
+import contextvars
+import glob
+import json
+import logging
+import os
+import random
+import secrets
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1") != "0"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "5000"))
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join("traces", "traces.jsonl"))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "5"))
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "dishcovery")
+
+# OTLP SpanKind / StatusCode values
+SPAN_KIND = {"internal": 1, "server": 2, "client": 3}
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+# Attempt number of the logical upstream call in progress (router failover index
+# plus hedge index); stamped on every client span as ``retry_count``.
+_retry_count: contextvars.ContextVar[int] = contextvars.ContextVar("retry_count", default=0)
+_exporter: Optional[logging.Logger] = None
+
+
+class Span:
+    __slots__ = (
+        "name", "kind", "trace_id", "span_id", "parent_id", "root", "sampled",
+        "start_ns", "end_ns", "attributes", "status", "status_message", "_spans",
+    )
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, kind: str = "internal", **attributes):
+        self.name = name
+        self.kind = kind
+        self.span_id = secrets.token_hex(8)
+        self.attributes: Dict[str, object] = {k: v for k, v in attributes.items() if v is not None}
+        self.status = STATUS_OK
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+
+        if parent is None:
+            self.trace_id = secrets.token_hex(16)
+            self.parent_id = ""
+            self.root = self
+            self.sampled = random.random() < TRACE_SAMPLE_RATE
+            self._spans: List["Span"] = []
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.root = parent.root
+            self.sampled = parent.sampled
+
+    def set_attribute(self, key: str, value: object) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, **attributes) -> None:
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(exc).__name__}: {exc}"
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_otlp(self) -> Dict[str, object]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": SPAN_KIND.get(self.kind, 1),
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": self.status, "message": self.status_message} if self.status == STATUS_ERROR else {"code": self.status},
+        }
+
+
+class _NoopSpan:
+    """Stands in for a span when tracing is disabled so call sites need no checks."""
+
+    def set_attribute(self, key: str, value: object) -> None:
+        pass
+
+    def set_attributes(self, **attributes) -> None:
+        pass
+
+    def record_exception(self, exc: BaseException) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_value(value: object) -> Dict[str, object]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _get_exporter() -> logging.Logger:
+    global _exporter
+    if _exporter is None:
+        os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+        handler = RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUP_COUNT, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger = logging.getLogger("dishcovery.traces")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        _exporter = logger
+    return _exporter
+
+
+def _export(root: Span) -> None:
+    if not (root.sampled or root.duration_ms >= TRACE_SLOW_MS):
+        return
+    record = {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "dishcovery.tracing"},
+                        "spans": [span.to_otlp() for span in root._spans],
+                    }
+                ],
+            }
+        ]
+    }
+    try:
+        _get_exporter().info(json.dumps(record, separators=(",", ":")))
+    except OSError as err:  # pragma: no cover - tracing must never break a request
+        print(f"Warning: could not export trace: {err}")
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+def retry_count() -> int:
+    return _retry_count.get()
+
+
+@contextmanager
+def retrying(count: int) -> Iterator[None]:
+    """Client spans started inside the block record ``retry_count=count``."""
+    token = _retry_count.set(count)
+    try:
+        yield
+    finally:
+        _retry_count.reset(token)
+
+
+def start_span(name: str, kind: str = "internal", **attributes) -> Tuple[object, Optional[contextvars.Token]]:
+    """Start a span as a child of the current one (or a new trace) and make it current."""
+    if not TRACE_ENABLED:
+        return NOOP_SPAN, None
+    if kind == "client":
+        attributes.setdefault("retry_count", _retry_count.get())
+    span = Span(name, parent=_current_span.get(), kind=kind, **attributes)
+    return span, _current_span.set(span)
+
+
+def end_span(span, token: Optional[contextvars.Token], exc: Optional[BaseException] = None) -> None:
+    if not isinstance(span, Span):
+        return
+    if exc is not None:
+        span.record_exception(exc)
+    span.end_ns = time.time_ns()
+    span.root._spans.append(span)
+    if token is not None:
+        _current_span.reset(token)
+    if span.root is span:
+        _export(span)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes) -> Iterator[object]:
+    """
+    Trace the enclosed block, e.g.
+
+        with tracing.span("mistral.chat", kind="client", model=IMAGE_MODEL) as sp:
+            ...
+            sp.set_attribute("tokens.total", usage.total_tokens)
+    """
+    current, token = start_span(name, kind=kind, **attributes)
+    try:
+        yield current
+    except BaseException as exc:
+        end_span(current, token, exc)
+        raise
+    end_span(current, token)
+
+
+def record_usage(target, usage) -> None:
+    """Copy token usage from a Mistral response onto a span."""
+    if usage is None:
+        return
+    target.set_attributes(
+        **{
+            "llm.tokens.prompt": getattr(usage, "prompt_tokens", None),
+            "llm.tokens.completion": getattr(usage, "completion_tokens", None),
+            "llm.tokens.total": getattr(usage, "total_tokens", None),
+        }
+    )
+
+
+# ----------------------------------------------------------------------
+# Summary tool
+# ----------------------------------------------------------------------
+def _load_traces(path: str) -> Dict[str, List[Dict]]:
+    traces: Dict[str, List[Dict]] = defaultdict(list)
+    for file_path in sorted(glob.glob(f"{path}*")):
+        with open(file_path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                for resource in record.get("resourceSpans", []):
+                    for scope in resource.get("scopeSpans", []):
+                        for item in scope.get("spans", []):
+                            traces[item["traceId"]].append(item)
+    return traces
+
+
+def _duration_ms(item: Dict) -> float:
+    return (int(item["endTimeUnixNano"]) - int(item["startTimeUnixNano"])) / 1e6
+
+
+def critical_path(spans: List[Dict]) -> List[Tuple[int, Dict]]:
+    """
+    Return (depth, span) pairs on the critical path, in start order.
+
+    Walks backwards from each span's end: the child that finished last is what the
+    parent was waiting on, then the child that finished before that one started,
+    and so on, recursing into each child picked.
+    """
+    children: Dict[str, List[Dict]] = defaultdict(list)
+    root = None
+    for item in spans:
+        if item.get("parentSpanId"):
+            children[item["parentSpanId"]].append(item)
+        else:
+            root = item
+    if root is None:
+        return []
+
+    def walk(item: Dict, depth: int) -> List[Tuple[int, Dict]]:
+        picked: List[Dict] = []
+        cursor = int(item["endTimeUnixNano"])
+        for child in sorted(children.get(item["spanId"], []), key=lambda c: -int(c["endTimeUnixNano"])):
+            if int(child["endTimeUnixNano"]) <= cursor:
+                picked.append(child)
+                cursor = int(child["startTimeUnixNano"])
+        path = [(depth, item)]
+        for child in reversed(picked):
+            path.extend(walk(child, depth + 1))
+        return path
+
+    return walk(root, 0)
+
+
+def _format_attributes(item: Dict) -> str:
+    shown = []
+    for attribute in item.get("attributes", []):
+        value = next(iter(attribute["value"].values()))
+        shown.append(f"{attribute['key']}={value}")
+    return ", ".join(shown)
+
+
+def summarize(path: str = TRACE_FILE, top: int = 10) -> None:
+    traces = _load_traces(path)
+    if not traces:
+        print(f"No traces found at {path}")
+        return
+
+    roots: List[Tuple[float, str, Dict]] = []
+    by_name: Dict[str, List[float]] = defaultdict(list)
+    for trace_id, spans in traces.items():
+        for item in spans:
+            by_name[item["name"]].append(_duration_ms(item))
+            if not item.get("parentSpanId"):
+                roots.append((_duration_ms(item), trace_id, item))
+
+    print(f"{len(traces)} traces\n")
+    print(f"{'span':40} {'count':>6} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10}")
+    for name, durations in sorted(by_name.items(), key=lambda kv: -max(kv[1])):
+        durations.sort()
+        p50 = durations[len(durations) // 2]
+        p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        print(f"{name[:40]:40} {len(durations):>6} {p50:>10.1f} {p95:>10.1f} {durations[-1]:>10.1f}")
+
+    print(f"\nSlowest {min(top, len(roots))} traces (critical path):")
+    for duration, trace_id, root in sorted(roots, key=lambda r: -r[0])[:top]:
+        print(f"\n{trace_id}  {root['name']}  {duration:.1f} ms")
+        for depth, item in critical_path(traces[trace_id]):
+            error = "  [ERROR]" if item.get("status", {}).get("code") == STATUS_ERROR else ""
+            print(f"  {'  ' * depth}{item['name']}  {_duration_ms(item):.1f} ms{error}  {_format_attributes(item)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise exported traces.")
+    parser.add_argument("command", choices=["summarize"])
+    parser.add_argument("--file", default=TRACE_FILE, help="trace file (rotated backups are read too)")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest traces to show")
+    args = parser.parse_args()
+    summarize(args.file, args.top)